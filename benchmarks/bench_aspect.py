@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""bench_aspect: per call overhead of :py:func:`advertise` with an empty pipeline
+and with a few transforms
+
+Run with: python benchmarks/bench_aspect.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.aspect import advertise, args_only
+from dyno.registry import Registry
+
+def identity(*args, **kwargs):
+    return args, kwargs
+
+@args_only
+def args_identity(*args):
+    return args
+
+def plain(a, b):
+    return a + b
+
+registry = {}
+empty = advertise('bench.empty', registry)(plain)
+piped = advertise('bench.piped', registry)(plain)
+registry['bench.piped'] = [identity, identity, identity]
+args_piped = advertise('bench.args', registry)(plain)
+registry['bench.args'] = [args_identity, args_identity, args_identity]
+versioned = Registry()
+versioned_empty = advertise('bench.empty', versioned)(plain)
+
+CASES = [
+    ('plain call', lambda: plain(1, 2)),
+    ('advertise (empty pipeline)', lambda: empty(1, 2)),
+    ('advertise (empty pipeline, Registry)', lambda: versioned_empty(1, 2)),
+    ('advertise (3 transforms)', lambda: piped(1, 2)),
+    ('advertise (3 args_only transforms)', lambda: args_piped(1, 2)),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""bench_breaker: cost of passing through the breakers and limiters when they let
+the request through
+
+Run with: python benchmarks/bench_breaker.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.breaker import (AutoBreaker, Limiter, AdaptiveLimiter, TokenBucket,
+                          SlidingWindowCounter, KeyedLimiter)
+
+breaker = AutoBreaker()
+# limits are high enough that the benchmark is never refused
+limiter = Limiter(1000)
+adaptive = AdaptiveLimiter(100, max_limit=1000)
+bucket = TokenBucket(1e9)
+counter = SlidingWindowCounter(1e9)
+keyed = KeyedLimiter(lambda: TokenBucket(1e9))
+
+def breaker_check():
+    with breaker:
+        pass
+
+def limiter_check():
+    with limiter:
+        pass
+
+def adaptive_check():
+    with adaptive:
+        pass
+
+CASES = [
+    ('AutoBreaker.allow_request', breaker.allow_request),
+    ('AutoBreaker context manager', breaker_check),
+    ('Limiter context manager', limiter_check),
+    ('AdaptiveLimiter context manager', adaptive_check),
+    ('TokenBucket.try_acquire', bucket.try_acquire),
+    ('SlidingWindowCounter.try_acquire', counter.try_acquire),
+    ('KeyedLimiter.try_acquire', lambda: keyed.try_acquire('tenant')),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""bench_cache: per call overhead of :py:func:`cache` on a hit and on a miss
+
+Run with: python benchmarks/bench_cache.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.cache import cache, DictCache, linear_timeout
+
+class NullCache(DictCache):
+    """Never stores anything so every lookup is a miss"""
+    __slots__ = ()
+    def __setitem__(self, key, val):
+        pass
+
+def plain(a, b=None):
+    return a
+
+hit = cache(DictCache(), lifetime=3600)(plain)
+hit_linear = cache(DictCache(), lifetime=linear_timeout(3600))(plain)
+miss = cache(NullCache(), lifetime=3600)(plain)
+
+CASES = [
+    ('plain call', lambda: plain(1)),
+    ('cache hit', lambda: hit(1)),
+    ('cache hit (keyword args)', lambda: hit(1, b=2)),
+    ('cache hit (linear_timeout)', lambda: hit_linear(1)),
+    ('cache miss', lambda: miss(1)),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""bench_command: per call overhead of :py:func:`command` compared to stacking
+:py:func:`harness`, :py:func:`cache`, :py:class:`AutoBreaker`, :py:class:`Limiter`
+and :py:func:`retry` by hand
+
+Run with: python benchmarks/bench_command.py
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.breaker import AutoBreaker, Limiter
+from dyno.cache import cache, DictCache
+from dyno.command import command
+from dyno.harness import harness
+from dyno.metrics import Metrics
+from dyno.retry import retry
+
+logger = logging.getLogger('bench_command')
+
+def plain(x):
+    return x
+
+def stacked(use_cache):
+    breaker = AutoBreaker(window=Metrics().window)
+    limiter = Limiter(100)
+    attempts = retry(3)(plain, execute=False)
+
+    def guarded(x):
+        with breaker, limiter:
+            return attempts(x)
+    if use_cache:
+        guarded = cache(DictCache(), lifetime=60)(guarded)
+    return harness(logger)(guarded)
+
+def fused(use_cache):
+    policy = dict(breaker=True, limiter=100, retry=3, metrics=Metrics(), logger=logger)
+    if use_cache:
+        policy.update(cache=DictCache(), lifetime=60)
+    return command(**policy)(plain)
+
+stacked_hit, fused_hit = stacked(True), fused(True)
+stacked_miss, fused_miss = stacked(False), fused(False)
+
+CASES = [
+    ('plain call', lambda: plain(1)),
+    ('stacked decorators (cache hit)', lambda: stacked_hit(1)),
+    ('command (cache hit)', lambda: fused_hit(1)),
+    ('stacked decorators (no cache)', lambda: stacked_miss(1)),
+    ('command (no cache)', lambda: fused_miss(1)),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
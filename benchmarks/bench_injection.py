@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""bench_injection: per call overhead of :py:decorator:`inject` and :py:decorator:`inject3`
+compared to calling the function directly
+
+Run with: python benchmarks/bench_injection.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.injection import inject, inject3
+
+def dep(request, key):
+    return key
+
+def plain(a=None, b=None):
+    return a, b
+
+@inject(a=dep, b=dep)
+def injected(a=None, b=None):
+    return a, b
+
+@inject3
+def injected3(a:dep=None, b:dep=None) -> tuple:
+    return a, b
+
+CASES = [
+    ('plain call', lambda: plain('a', 'b')),
+    ('inject', lambda: injected()),
+    ('inject3', lambda: injected3()),
+    ('inject3 (caller overrides all)', lambda: injected3('a', b='b')),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
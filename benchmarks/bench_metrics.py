@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""bench_metrics: cost of recording an outcome in :py:class:`Metrics` and its
+:py:class:`RollingWindow`
+
+Run with: python benchmarks/bench_metrics.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.metrics import Metrics
+
+metrics = Metrics()
+window = metrics.window
+
+CASES = [
+    ('Metrics.success', metrics.success),
+    ('Metrics.incr', lambda: metrics.incr('requests')),
+    ('RollingWindow.add', lambda: window.add('success')),
+    ('RollingWindow.totals', window.totals),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""bench_registry: cost of reading through a :py:class:`RegistryProxy` and of
+looking keys up in a :py:class:`Registry` and an overlay
+
+Run with: python benchmarks/bench_registry.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.registry import Registry, RegistryProxy
+
+class Service:
+    name = 'db'
+
+registry = Registry()
+registry['db'] = Service()
+proxy = RegistryProxy(registry, 'db')
+bound = registry.bind('db')
+overlay = registry.overlay()
+service = Service()
+
+CASES = [
+    ('plain attribute', lambda: service.name),
+    ('RegistryProxy attribute', lambda: proxy.name),
+    ('Registry.bind object attribute', lambda: bound.name),
+    ('Registry lookup', lambda: registry['db']),
+    ('overlay lookup (falls through)', lambda: overlay['db']),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""bench_retry: per call overhead of :py:func:`retry` when the first attempt succeeds
+
+Run with: python benchmarks/bench_retry.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.retry import retry, Policy, exponential, RetryBudget
+
+def plain(x):
+    return x
+
+simple = retry(3)(plain, execute=False)
+full = retry(Policy(3, backoff=exponential(), deadline=1, budget=RetryBudget()))(plain, execute=False)
+
+CASES = [
+    ('plain call', lambda: plain(1)),
+    ('retry (succeeds first time)', lambda: simple(1)),
+    ('retry with deadline and budget', lambda: full(1)),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
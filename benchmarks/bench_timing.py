@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""bench_timing: cost of starting and stopping a :py:class:`PerfTimer`
+
+Run with: python benchmarks/bench_timing.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.timing import PerfTimer, SpanRecorder
+
+def start_stop():
+    PerfTimer('bench').start().stop()
+
+def context():
+    with PerfTimer('bench'):
+        pass
+
+# long running timers that get a child per call, cleared between runs so the
+# recorder doesn't grow without bound
+root = PerfTimer('bench').start()
+recorder = SpanRecorder()
+
+def child():
+    if len(root.recorder) > 100000:
+        root.recorder.clear()
+        root.recorder.add('bench')
+    with root('child'):
+        pass
+
+def begin_end():
+    if len(recorder) > 100000:
+        recorder.clear()
+    recorder.end(recorder.begin('span'))
+
+CASES = [
+    ('PerfTimer start/stop', start_stop),
+    ('PerfTimer context manager', context),
+    ('PerfTimer child (shared recorder)', child),
+    ('SpanRecorder begin/end', begin_end),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""bench_watchdog: per call overhead of tracking a fast call with :py:class:`Watchdog`
+
+Run with: python benchmarks/bench_watchdog.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from runner import report
+from dyno.watchdog import Watchdog
+
+watchdog = Watchdog(threshold=1.0)
+
+def plain():
+    pass
+
+tracked = watchdog('bench')(plain)
+
+CASES = [
+    ('plain call', plain),
+    ('Watchdog tracked call', tracked),
+]
+
+def main(number=100000, repeat=5):
+    report(CASES, number, repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""runner: run every benchmark in this directory and compare runs
+
+Each ``bench_*.py`` module provides ``CASES``, a list of (name, function) pairs.
+every function is timed on its own (single threaded) and called from several
+threads at once to show the cost of lock contention
+
+Run all benchmarks and save the results:
+    python benchmarks/runner.py run --json before.json
+
+Compare two runs, exits with status 1 if anything got slower than the threshold:
+    python benchmarks/runner.py compare before.json after.json --threshold 0.1
+"""
+from threading import Barrier, Thread
+from time import perf_counter
+from timeit import Timer
+import argparse
+import glob
+import importlib
+import json
+import os
+import platform
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+def measure(case, number, repeat):
+    """:returns: best seconds per call of <case> over <repeat> runs of <number> calls"""
+    return min(Timer(case).repeat(repeat, number)) / number
+
+def measure_threaded(case, threads, number, repeat):
+    """Call <case> <number> times from each of <threads> threads at the same time
+
+    :returns: best wall clock seconds per call over <repeat> runs, lower is better
+              and lock contention shows up as this rising with the thread count
+    """
+    best = None
+    for i in range(repeat):
+        barrier = Barrier(threads + 1)
+
+        def worker():
+            barrier.wait()
+            for j in range(number):
+                case()
+
+        workers = [Thread(target=worker) for t in range(threads)]
+        for worker_thread in workers:
+            worker_thread.start()
+        start = perf_counter()
+        barrier.wait()
+        for worker_thread in workers:
+            worker_thread.join()
+        elapsed = (perf_counter() - start) / (number * threads)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def report(cases, number=100000, repeat=5):
+    """Print the time per call of each of <cases> and its overhead compared to the first"""
+    baseline = None
+    for name, case in cases:
+        best = measure(case, number, repeat)
+        if baseline is None:
+            baseline = best
+        print('{:<40} {:8.3f} uS/call  {:+8.3f} uS overhead'.format(
+              name, best * 1e6, (best - baseline) * 1e6))
+
+def load(pattern=None):
+    """:returns: [(module name, CASES)] for every bench_*.py module"""
+    modules = []
+    for path in sorted(glob.glob(os.path.join(HERE, 'bench_*.py'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        module = importlib.import_module(name)
+        cases = [(case_name, case) for case_name, case in module.CASES
+                 if not pattern or pattern in '{}:{}'.format(name, case_name)]
+        if cases:
+            modules.append((name, cases))
+    return modules
+
+def run(pattern=None, threads=(4,), number=20000, repeat=5):
+    """Run the benchmarks
+
+    :returns: dict describing the machine and the seconds per call of each case
+    """
+    results = {}
+    for module, cases in load(pattern):
+        for name, case in cases:
+            key = '{}:{}'.format(module, name)
+            results[key] = measure(case, number, repeat)
+            print('{:<64} {:8.3f} uS/call'.format(key, results[key] * 1e6))
+            for count in threads:
+                threaded_key = '{} [threads={}]'.format(key, count)
+                results[threaded_key] = measure_threaded(case, count, number // count, repeat)
+                print('{:<64} {:8.3f} uS/call'.format(threaded_key, results[threaded_key] * 1e6))
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'number': number,
+        'repeat': repeat,
+        'results': results,
+    }
+
+def compare(old, new, threshold=0.1):
+    """Compare two runs
+
+    :param dict old: The results of :py:func:`run` to compare against
+    :param dict new: The results of :py:func:`run` being checked
+    :param float threshold: Fraction a case may slow down before it is a regression
+    :returns: list of (case, old seconds per call, new seconds per call) that regressed
+    """
+    regressions = []
+    old_results, new_results = old['results'], new['results']
+    for key in sorted(set(old_results) | set(new_results)):
+        if key not in old_results or key not in new_results:
+            print('{:<64} {}'.format(key, 'only in new run' if key in new_results else 'only in old run'))
+            continue
+        before, after = old_results[key], new_results[key]
+        change = (after - before) / before
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append((key, before, after))
+        elif change < -threshold:
+            flag = 'improved'
+        print('{:<64} {:8.3f} -> {:8.3f} uS/call {:+7.1%} {}'.format(
+              key, before * 1e6, after * 1e6, change, flag))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='dyno benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--json', help='file to save the results to')
+    run_parser.add_argument('--filter', help='only run cases whose "module:case" name contains this')
+    run_parser.add_argument('--threads', default='4',
+                            help='comma separated thread counts for the contention runs, 0 to skip')
+    run_parser.add_argument('--number', type=int, default=20000, help='calls per measurement')
+    run_parser.add_argument('--repeat', type=int, default=5, help='measurements per case, the best is kept')
+
+    compare_parser = commands.add_parser('compare', help='compare two saved runs')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='fraction a case may slow down before it is a regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        threads = tuple(int(count) for count in args.threads.split(',') if int(count) > 0)
+        results = run(args.filter, threads, args.number, args.repeat)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print('{} case(s) regressed by more than {:.0%}'.format(len(regressions), args.threshold))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,7 +9,7 @@ dyno registration framework
 ... def test(a, b, c):
 ...     return a+b+c
 >>> registry
-{'mymodule.func': []}
+{'mymodule.func': ()}
 >>> test(1,1,1)
 3
 
@@ -31,12 +31,88 @@ dyno registration framework
 >>> test(1,1,1) # gets transformed to (2,15,2)
 19
 
+# transforms that only change the positional or keyword arguments can say so
+# and skip repacking the half they don't touch
+>>> @args_only
+... def double(*args):
+...     return [arg*2 for arg in args]
+>>> registry['mymodule.func'] = [double]
+>>> test(1,2,3)
+12
+
+The pipeline is compiled into a single chain of calls the first time the function
+is called after a pipeline is registered, an empty pipeline compiles to the function
+itself. with a :py:class:`dyno.registry.Registry` calls only compare its version
+number until the registry changes. pipelines are compiled from a tuple snapshot,
+register a tuple (or a new list) to change the pipeline. a list changed in place
+is only seen the next time the registry changes
+
+>>> from dyno.registry import Registry
+>>> registry = Registry()
+>>> @advertise('mymodule.total', registry)
+... def total(*args):
+...     return sum(args)
+>>> total(1, 2)
+3
+>>> registry['mymodule.total'] = [double]
+>>> total(1, 2)
+6
+>>> registry['mymodule.total'].append(double)
+>>> registry['mymodule.total'] = registry['mymodule.total']
+>>> total(1, 2)
+12
 """
 from functools import wraps as _wraps
 import logging as _logging
 
 log = _logging.getLogger('dyno.aspect')
 
+def args_only(transform):
+    """Mark <transform> as only changing the positional arguments
+
+    The transform is called with the positional arguments and returns the new
+    positional arguments, keyword arguments are passed through untouched
+    """
+    transform.touches = 'args'
+    return transform
+
+def kwargs_only(transform):
+    """Mark <transform> as only changing the keyword arguments
+
+    The transform is called with the keyword arguments and returns a dict of the 
+    new keyword arguments, positional arguments are passed through untouched
+    """
+    transform.touches = 'kwargs'
+    return transform
+
+def _stage(transform, call):
+    """Build a function that applies <transform> and passes the result on to <call>"""
+    touches = getattr(transform, 'touches', None)
+    if touches == 'args':
+        def stage(*args, **kwargs):
+            return call(*transform(*args), **kwargs)
+    elif touches == 'kwargs':
+        def stage(*args, **kwargs):
+            return call(*args, **transform(**kwargs))
+    else:
+        def stage(*args, **kwargs):
+            args, kwargs = transform(*args, **kwargs)
+            return call(*args, **kwargs)
+    return stage
+
+def compile_pipeline(pipeline, func):
+    """Compose a pipeline of transforms and the function it feeds into a single callable
+
+    :param list pipeline: transforms to apply in order
+    :param func: the function to call with the transformed arguments
+    :returns: a function taking the original arguments and returning the result of <func>
+    :rtype: func
+    """
+    call = func
+    for transform in reversed(pipeline):
+        call = _stage(transform, call)
+    return call
+
 def advertise(name, registry=None): # XXX TODO: if registry == None, load default registry
     """Advertise function at <name> on <registry> so that a pipeline of cuntions can be plugged in
     
@@ -49,17 +125,38 @@ def advertise(name, registry=None): # XXX TODO: if registry == None, load defaul
     """
     def outer_wrapper(wrapped_func):
         """Lifetime: Function Defeinition"""
-        registry[name] = []
+        registry[name] = ()
         log.info('Registered join point "%s"', wrapped_func)
+        # (registry version, tuple the function was compiled from, compiled
+        # function), swapped as a single item so other threads never see a
+        # mismatched set
+        compiled = [(None, None, wrapped_func)]
+        # plain dicts have no version, the registered pipeline is looked up each call
+        versioned = hasattr(registry, '_version')
         
         @_wraps(wrapped_func)
         def inner_wrapper(*args, **kwargs):
             """Lifetime: When Targeted Function is Called"""
+            version, seen, call = compiled[0]
+            if versioned:
+                current = registry._version
+                if current == version:
+                    return call(*args, **kwargs)
+            else:
+                current = None
+
             pipeline = registry[name]
-            for func in pipeline:
-                args, kwargs = func(*args, **kwargs)
-            
-            return wrapped_func(*args, **kwargs)
+            if pipeline is not seen:
+                # a registered tuple is its own snapshot, a list is copied so
+                # changing it later can't change what was compiled
+                pipeline = tuple(pipeline)
+                if pipeline != seen:
+                    log.debug('Compiling pipeline for "%s"', name)
+                    call = compile_pipeline(pipeline, wrapped_func)
+            if current != version or pipeline is not seen:
+                compiled[0] = current, pipeline, call
+
+            return call(*args, **kwargs)
             
         return inner_wrapper
     return outer_wrapper
@@ -1,7 +1,43 @@
 #!/usr/bin/env python3
-"""Detchord: bring an application to a halt through constructive destruction"""
+"""Detchord: bring an application to a halt through constructive destruction
 
-from threading import _Semaphore
+:py:class:`Breaker`: A manual fuse that can be tripped and reset
+:py:class:`AutoBreaker`: A :py:class:`Breaker` that trips itself when the error rate
+                         gets too high and closes again once the service recovers
+:py:class:`Limiter`: Bound the amount of concurrent requests (semaphore isolation)
+:py:class:`AdaptiveLimiter`: A :py:class:`Limiter` that resizes itself based on
+                             observed latency
+:py:class:`AIMD`: Additive increase/multiplicative decrease limit algorithm
+:py:class:`Gradient`: Latency gradient limit algorithm (Vegas/Netflix concurrency-limits)
+:py:class:`TokenBucket`: Limit throughput to a rate in requests per second with bursts
+:py:class:`SlidingWindowLog`: Exact limit of requests per time window
+:py:class:`SlidingWindowCounter`: Approximate limit of requests per time window in
+                                  constant memory
+:py:class:`KeyedLimiter`: A rate limiter per key (tenant, endpoint, ...)
+
+Limiters never queue, if there are too many requests in flight :py:exc:`RateLimited`
+is raised straight away so the caller can shed the load instead of waiting on a
+timeout
+
+>>> limiter = Limiter(1)
+>>> with limiter:
+...     with limiter:
+...         pass
+Traceback (most recent call last):
+  ...
+dyno.breaker.RateLimited
+>>> limiter.inflight
+0
+"""
+
+from dyno.metrics import RollingWindow as _RollingWindow
+from collections import OrderedDict as _OrderedDict, deque as _deque
+from threading import Lock as _Lock, local as _local
+from time import monotonic as _monotonic, sleep as _sleep
+import asyncio as _asyncio
+import logging as _logging
+
+log = _logging.getLogger('dyno.breaker')
 
 class Broken(Exception):
     """Breaker has been tripped"""
@@ -12,26 +48,680 @@ class RateLimited(Exception):
 class Breaker:
     def __init__(self):
         self.reset()
-        
+
     def __enter__(self):
         if not self:
             raise Broken()
-        
+
     def __exit__(self, *tb):
         pass
 
     def trigger(self):
         self._status = False
-        
+
     def reset(self):
         self._status = True
 
     def __bool__(self):
         return self._status
 
-class Limiter(_Semaphore):
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class AutoBreaker(Breaker):
+    """Circuit breaker that opens when too many requests fail
+
+    Outcomes are counted in a rolling window, once at least <volume_threshold>
+    requests have been seen and <error_threshold> percent of them failed the
+    breaker opens and every request is refused with :py:exc:`Broken`. after
+    <sleep_window> seconds a single trial request is let through (half open),
+    if it succeeds the breaker closes, otherwise it stays open for another
+    <sleep_window>. a trial that has not reported back within <sleep_window>
+    counts as failed so a lost trial can't leave the breaker half open for good
+
+    The error rate is only recalculated when a failure is recorded and at most
+    once every <health_interval> seconds so a closed breaker costs a single
+    comparison per request
+
+    :param float error_threshold: Percentage of failed requests that opens the breaker
+    :param int volume_threshold: Minimum amount of requests in the window before
+                                 the breaker may open
+    :param float sleep_window: Seconds to stay open before allowing a trial request
+    :param float latency: (optional) requests slower than this many seconds are
+                          counted as a timeout (failure) even if they succeed
+    :param RollingWindow window: (optional) window to record outcomes in, may be
+                                 shared with a :py:class:`dyno.metrics.Metrics`
+    :param float health_interval: Minimum seconds between error rate calculations
+    :param clock: function returning the current time in seconds
+
+    >>> t = [0.0]
+    >>> breaker = AutoBreaker(volume_threshold=2, sleep_window=5,
+    ...                       health_interval=0, clock=lambda: t[0])
+    >>> breaker.failure(); breaker.failure()
+    >>> breaker.state
+    'open'
+    >>> with breaker:
+    ...     pass
+    Traceback (most recent call last):
+      ...
+    dyno.breaker.Broken
+    >>> t[0] = 6.0
+    >>> with breaker:
+    ...     breaker.state
+    'half-open'
+    >>> breaker.state
+    'closed'
+
+    >>> breaker.trigger(); breaker.reset()
+    >>> breaker.failure(); breaker.failure()
+    >>> t[0] = 12.0
+    >>> breaker.allow_request(), breaker.state # the trial never reports back
+    (True, 'half-open')
+    >>> t[0] = 18.0
+    >>> breaker.allow_request(), breaker.state
+    (False, 'open')
+    """
+    def __init__(self, error_threshold=50, volume_threshold=20, sleep_window=5,
+                 latency=None, window=None, health_interval=0.5, clock=_monotonic):
+        self.error_threshold = error_threshold
+        self.volume_threshold = volume_threshold
+        self.sleep_window = sleep_window
+        self.latency = latency
+        self.health_interval = health_interval
+        self.clock = clock
+        self.window = _RollingWindow(clock=clock) if window is None else window
+        self._lock = _Lock()
+        self._starts = _local()
+        super().__init__()
+
+    def trigger(self):
+        """Open the breaker until :py:meth:`reset` is called"""
+        with self._lock:
+            self.state = OPEN
+            self._forced = True
+            self._opened_at = self.clock()
+
+    def reset(self):
+        """Close the breaker and forget all previous outcomes"""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        self.state = CLOSED
+        self._forced = False
+        self._opened_at = None
+        self._trial_at = None
+        self._next_check = 0
+        self.window.reset()
+
+    def _open(self, now):
+        log.warning('%r opening', self)
+        self.state = OPEN
+        self._opened_at = now
+
+    def __bool__(self):
+        return self.state is not OPEN
+
+    def allow_request(self, now=None):
+        """Check if a request may proceed
+
+        :param float now: (optional) the current time if already known
+        :returns: True if the request may proceed
+        :rtype: bool
+        """
+        state = self.state
+        if state is CLOSED:
+            return True
+
+        if now is None:
+            now = self.clock()
+        if state is OPEN and not self._forced and now >= self._opened_at + self.sleep_window:
+            with self._lock:
+                # only one thread gets to be the trial request
+                if self.state is OPEN and not self._forced:
+                    self.state = HALF_OPEN
+                    self._trial_at = now
+                    return True
+        elif state is HALF_OPEN and now >= self._trial_at + self.sleep_window:
+            with self._lock:
+                if self.state is HALF_OPEN and now >= self._trial_at + self.sleep_window:
+                    log.warning('%r trial request did not report back, treating it as failed', self)
+                    self._open(now)
+
+        self.window.add('short_circuit', now=now)
+        return False
+
+    def success(self, now=None, duration=None):
+        """Record a successful request
+
+        :param float now: (optional) the current time if already known
+        :param float duration: (optional) how long the request took, compared
+                               against <latency>
+        """
+        if duration is not None and self.latency is not None and duration > self.latency:
+            self.failure(now, 'timeout')
+            return
+
+        if self.state is HALF_OPEN:
+            with self._lock:
+                if self.state is HALF_OPEN:
+                    log.info('%r trial request succeeded, closing', self)
+                    self._close()
+                    return
+        self.window.add('success', now=now)
+
+    def failure(self, now=None, event='failure'):
+        """Record a failed request
+
+        :param float now: (optional) the current time if already known
+        :param str event: The kind of failure, 'failure' or 'timeout'
+        """
+        if now is None:
+            now = self.clock()
+
+        if self.state is HALF_OPEN:
+            with self._lock:
+                if self.state is HALF_OPEN:
+                    self._open(now)
+                    return
+        self.window.add(event, now=now)
+
+        if self.state is CLOSED and now >= self._next_check:
+            self._next_check = now + self.health_interval
+            self._check_health(now)
+
+    def _check_health(self, now):
+        totals = self.window.totals(now)
+        errors = totals['failure'] + totals['timeout']
+        volume = totals['success'] + errors
+        if volume < self.volume_threshold:
+            return
+        if errors * 100 / volume >= self.error_threshold:
+            with self._lock:
+                if self.state is CLOSED:
+                    self._open(now)
+
+    def __enter__(self):
+        now = self.clock()
+        if not self.allow_request(now):
+            raise Broken()
+        stack = getattr(self._starts, 'stack', None)
+        if stack is None:
+            stack = self._starts.stack = []
+        stack.append(now)
+        return self
+
+    def __exit__(self, exc_type, *tb):
+        start = self._starts.stack.pop()
+        now = self.clock()
+        if exc_type is None:
+            self.success(now, now - start)
+        else:
+            self.failure(now)
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.state)
+
+class Limiter:
+    """Semaphore isolation: allow at most <value> requests in flight at once and
+    reject the rest with :py:exc:`RateLimited`
+
+    :param int value: The maximum amount of concurrent requests
+    """
+    def __init__(self, value=1):
+        if value < 1:
+            raise ValueError('Limiter value must be >= 1')
+        self._lock = _Lock()
+        self._limit = value
+        self.inflight = 0
+
+    @property
+    def limit(self):
+        """The current concurrency limit"""
+        return self._limit
+
+    def acquire(self):
+        """Take a slot or raise :py:exc:`RateLimited` if none are free"""
+        with self._lock:
+            if self.inflight >= self._limit:
+                raise RateLimited()
+            self.inflight += 1
+
+    def release(self):
+        """Give back a slot taken with :py:meth:`acquire`"""
+        with self._lock:
+            self.inflight -= 1
+
+    def cancel(self, token=None):
+        """Give back a slot taken with :py:meth:`acquire` for a request that was
+        never made, the limit is left as it is
+        """
+        with self._lock:
+            self.inflight -= 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *tb):
+        self.release()
+
+    def __repr__(self):
+        return '<{}: {}/{}>'.format(self.__class__.__name__, self.inflight, self._limit)
+
+class AIMD:
+    """Additive increase/multiplicative decrease
+
+    Grow the limit by <increase> while the limiter is being used and a request
+    completes in less than <latency>, shrink it by <backoff> when a request fails
+    or takes longer than <latency>
+
+    :param float latency: Requests slower than this (in seconds) count as a drop
+    :param float backoff: Multiplier applied to the limit on a drop (0.0 to 1.0)
+    :param int increase: Amount to add to the limit on success
+
+    >>> algo = AIMD(latency=0.1)
+    >>> algo.update(10, rtt=0.01, inflight=8, dropped=False)
+    11
+    >>> algo.update(10, rtt=0.5, inflight=8, dropped=False)
+    9
+    """
+    def __init__(self, latency=1.0, backoff=0.9, increase=1):
+        self.latency = latency
+        self.backoff = backoff
+        self.increase = increase
+
+    def update(self, limit, rtt, inflight, dropped):
+        """Calculate the new limit after a request completes
+
+        :param int limit: The current limit
+        :param float rtt: How long the request took in seconds
+        :param int inflight: Amount of requests in flight when the request was started
+        :param bool dropped: True if the request failed
+        :returns: The new limit
+        :rtype: int
+        """
+        if dropped or rtt > self.latency:
+            return int(limit * self.backoff)
+        # only grow if we are actually using the limit, otherwise a quiet
+        # period would inflate the limit without any evidence it is safe
+        if inflight * 2 >= limit:
+            return limit + self.increase
+        return limit
+
+class Gradient:
+    """Latency gradient, similar to Netflix's Gradient2 limit
+
+    Tracks a long term (baseline) and short term average of the round trip time.
+    when the short term average rises above the baseline the limit is scaled down
+    by the ratio between them, when they agree the limit grows by a queue allowance
+    of sqrt(limit). the limit is returned unrounded, with the default smoothing a
+    step is often less than 1 and rounding each one would stop small limits growing
+
+    :param float smoothing: how fast the limit moves toward its new value (0.0 to 1.0)
+    :param float tolerance: how much higher than the baseline latency may rise before
+                            the limit is reduced
+    :param int short_window: Amount of samples in the short term average
+    :param int long_window: Amount of samples in the long term average
+
+    >>> algo = Gradient(smoothing=1.0)
+    >>> algo.update(16, rtt=0.01, inflight=16, dropped=False)
+    20.0
+    >>> algo.update(20, rtt=0.1, inflight=20, dropped=False) < 20
+    True
+    """
+    def __init__(self, smoothing=0.2, tolerance=1.5, short_window=10, long_window=600):
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self._short_factor = 2 / (short_window + 1)
+        self._long_factor = 2 / (long_window + 1)
+        self.short_rtt = None
+        self.long_rtt = None
+
+    def update(self, limit, rtt, inflight, dropped):
+        """See :py:meth:`AIMD.update`"""
+        if self.short_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+        else:
+            self.short_rtt += (rtt - self.short_rtt) * self._short_factor
+            self.long_rtt += (rtt - self.long_rtt) * self._long_factor
+
+        # don't grow the limit if the extra room is not being used
+        if not dropped and inflight * 2 < limit:
+            return limit
+
+        if dropped:
+            gradient = 0.5
+        else:
+            gradient = self.tolerance * self.long_rtt / self.short_rtt if self.short_rtt else 1.0
+            gradient = max(0.5, min(1.0, gradient))
+
+        new_limit = limit * gradient + limit ** 0.5
+        return limit * (1 - self.smoothing) + new_limit * self.smoothing
+
+class AdaptiveLimiter(Limiter):
+    """A :py:class:`Limiter` that adjusts its own limit from the latency of the
+    requests passing through it
+
+    As latency rises the limit drops, causing new requests to be shed early
+    with :py:exc:`RateLimited` instead of queueing up behind a slow service
+
+    :param int value: The initial concurrency limit
+    :param algorithm: Limit algorithm, :py:class:`AIMD` or :py:class:`Gradient`
+                      (Default: :py:class:`Gradient`)
+    :param int min_limit: The limit will never go below this
+    :param int max_limit: The limit will never go above this
+    :param clock: function returning the current time in seconds
+
+    >>> limiter = AdaptiveLimiter(10, AIMD(latency=0.1))
+    >>> start = limiter.acquire()
+    >>> limiter.release(start, dropped=True)
+    >>> limiter.limit
+    9
+
+    The limit grows back once requests are healthy again, even while each step
+    of the algorithm is less than one request
+
+    >>> limiter = AdaptiveLimiter(20, clock=lambda: 0.0)
+    >>> limiter.release(limiter.acquire(), dropped=True)
+    >>> limiter.limit
+    18
+    >>> for i in range(10):
+    ...     tokens = [limiter.acquire() for j in range(limiter.limit)]
+    ...     for token in tokens:
+    ...         limiter.release(token)
+    >>> limiter.limit > 20
+    True
+    """
+    def __init__(self, value=20, algorithm=None, min_limit=1, max_limit=1000, clock=_monotonic):
+        super().__init__(value)
+        # the unrounded limit the algorithm works on, _limit is this rounded down
+        self._estimate = float(value)
+        self.algorithm = Gradient() if algorithm is None else algorithm
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.clock = clock
+        self._starts = _local()
+
     def acquire(self):
-        if not _Semaphore.acquire(self, False):
+        """Take a slot or raise :py:exc:`RateLimited` if none are free
+
+        :returns: A token to be passed back to :py:meth:`release`
+        """
+        with self._lock:
+            if self.inflight >= self._limit:
+                raise RateLimited()
+            self.inflight += 1
+            inflight = self.inflight
+        return self.clock(), inflight
+
+    def release(self, token, dropped=False):
+        """Give back a slot and feed the request's latency into the limit algorithm
+
+        :param token: The value returned by :py:meth:`acquire`
+        :param bool dropped: True if the request failed or timed out
+        """
+        start, inflight = token
+        rtt = self.clock() - start
+        with self._lock:
+            self.inflight -= 1
+            estimate = self.algorithm.update(self._estimate, rtt, inflight, dropped)
+            self._estimate = estimate = max(self.min_limit, min(self.max_limit, estimate))
+            limit = int(estimate)
+            if limit != self._limit:
+                log.debug('%r changing limit to %d (rtt=%.6f)', self, limit, rtt)
+            self._limit = limit
+
+    def __enter__(self):
+        token = self.acquire()
+        # context managers may be nested and used from several threads at
+        # once, keep a per thread stack of tokens
+        stack = getattr(self._starts, 'stack', None)
+        if stack is None:
+            stack = self._starts.stack = []
+        stack.append(token)
+        return self
+
+    def __exit__(self, exc_type, *tb):
+        token = self._starts.stack.pop()
+        self.release(token, dropped=exc_type is not None)
+
+
+class _RateLimiter:
+    """Base class of the throughput limiters, subclasses implement :py:meth:`_reserve`"""
+    def _reserve(self, n, now):
+        """Take <n> permits if available
+
+        :returns: 0 if the permits were taken, otherwise an estimate of how many
+                  seconds to wait before trying again
+        :rtype: float
+        """
+        raise NotImplementedError
+
+    def try_acquire(self, n=1):
+        """Take <n> permits without waiting
+
+        :returns: True if the permits were taken
+        :rtype: bool
+        """
+        return not self._reserve(n, self.clock())
+
+    def acquire(self, n=1, timeout=None):
+        """Wait until <n> permits can be taken
+
+        :param float timeout: (optional) maximum seconds to wait, raises
+                              :py:exc:`RateLimited` if exceeded
+        """
+        now = self.clock()
+        deadline = None if timeout is None else now + timeout
+        while True:
+            wait = self._reserve(n, now)
+            if not wait:
+                return
+            if deadline is not None and now + wait > deadline:
+                raise RateLimited()
+            _sleep(wait)
+            now = self.clock()
+
+    async def acquire_async(self, n=1, timeout=None):
+        """Same as :py:meth:`acquire` but waits with :py:func:`asyncio.sleep`"""
+        now = self.clock()
+        deadline = None if timeout is None else now + timeout
+        while True:
+            wait = self._reserve(n, now)
+            if not wait:
+                return
+            if deadline is not None and now + wait > deadline:
+                raise RateLimited()
+            await _asyncio.sleep(wait)
+            now = self.clock()
+
+    def __enter__(self):
+        if not self.try_acquire():
             raise RateLimited()
-        
-    __enter__ = acquire
+        return self
+
+    def __exit__(self, *tb):
+        pass
+
+class TokenBucket(_RateLimiter):
+    """Allow <rate> requests per second on average and bursts of up to <burst>
+
+    :param float rate: Permits added to the bucket per second
+    :param int burst: Size of the bucket (Default: rate)
+    :param clock: function returning the current time in seconds
+
+    >>> t = [0.0]
+    >>> bucket = TokenBucket(10, burst=2, clock=lambda: t[0])
+    >>> bucket.try_acquire(), bucket.try_acquire(), bucket.try_acquire()
+    (True, True, False)
+    >>> t[0] = 0.1
+    >>> bucket.try_acquire()
+    True
+    """
+    def __init__(self, rate, burst=None, clock=_monotonic):
+        self.rate = rate
+        self.burst = max(1, rate if burst is None else burst)
+        self.clock = clock
+        self._lock = _Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def _reserve(self, n, now):
+        if n > self.burst:
+            raise ValueError('Requested more permits than the burst size')
+        with self._lock:
+            tokens = self._tokens + (now - self._updated) * self.rate
+            if tokens > self.burst:
+                tokens = self.burst
+            self._updated = now
+            if tokens >= n:
+                self._tokens = tokens - n
+                return 0
+            self._tokens = tokens
+        return (n - tokens) / self.rate
+
+    def __repr__(self):
+        return '<{}: {}/s, burst={}>'.format(self.__class__.__name__, self.rate, self.burst)
+
+class SlidingWindowLog(_RateLimiter):
+    """Allow at most <limit> requests in any <span> seconds
+
+    Exact but keeps a timestamp for every permit handed out in the window, see
+    :py:class:`SlidingWindowCounter` for a constant memory version
+
+    :param int limit: Maximum amount of permits in the window
+    :param float span: Length of the window in seconds
+    :param clock: function returning the current time in seconds
+
+    >>> t = [0.0]
+    >>> window = SlidingWindowLog(2, span=1, clock=lambda: t[0])
+    >>> window.try_acquire(2), window.try_acquire()
+    (True, False)
+    >>> t[0] = 1.0
+    >>> window.try_acquire()
+    True
+    """
+    def __init__(self, limit, span=1, clock=_monotonic):
+        self.limit = limit
+        self.span = span
+        self.clock = clock
+        self._lock = _Lock()
+        self._log = _deque()
+
+    def _reserve(self, n, now):
+        if n > self.limit:
+            raise ValueError('Requested more permits than the limit')
+        log = self._log
+        with self._lock:
+            oldest = now - self.span
+            while log and log[0] <= oldest:
+                log.popleft()
+            if len(log) + n <= self.limit:
+                log.extend([now] * n)
+                return 0
+            # wait for enough of the old permits to drop out of the window
+            return log[len(log) + n - self.limit - 1] - oldest
+
+class SlidingWindowCounter(_RateLimiter):
+    """Allow roughly <limit> requests in any <span> seconds
+
+    Only the counts for the current and previous fixed window are kept, the
+    previous count is weighted by how much of it still overlaps the sliding
+    window
+
+    :param int limit: Maximum amount of permits in the window
+    :param float span: Length of the window in seconds
+    :param clock: function returning the current time in seconds
+
+    >>> t = [0.0]
+    >>> window = SlidingWindowCounter(4, span=1, clock=lambda: t[0])
+    >>> window.try_acquire(4), window.try_acquire()
+    (True, False)
+    >>> t[0] = 1.5 # half of the previous window still counts
+    >>> window.try_acquire(2), window.try_acquire()
+    (True, False)
+    """
+    def __init__(self, limit, span=1, clock=_monotonic):
+        self.limit = limit
+        self.span = span
+        self.clock = clock
+        self._lock = _Lock()
+        self._epoch = int(clock() / span)
+        self._current = 0
+        self._previous = 0
+
+    def _reserve(self, n, now):
+        if n > self.limit:
+            raise ValueError('Requested more permits than the limit')
+        span = self.span
+        epoch = int(now / span)
+        with self._lock:
+            if epoch != self._epoch:
+                self._previous = self._current if epoch == self._epoch + 1 else 0
+                self._current = 0
+                self._epoch = epoch
+            elapsed = now - epoch * span
+            weight = 1 - elapsed / span
+            estimate = self._previous * weight + self._current
+            if estimate + n <= self.limit:
+                self._current += n
+                return 0
+            if self._previous:
+                wait = (estimate + n - self.limit) * span / self._previous
+                return min(wait, span - elapsed)
+            return span - elapsed
+
+class KeyedLimiter:
+    """Rate limit per key, eg per tenant or per endpoint
+
+    A limiter is created for each key on first use from <factory> and kept in a
+    bounded LRU. the LRU is split into stripes with their own lock so threads
+    working on different keys rarely contend with each other
+
+    :param factory: Called with no arguments to build the limiter for a new key
+                    eg ``lambda: TokenBucket(100, burst=20)``
+    :param int maxsize: Approximate maximum amount of keys to remember
+    :param int stripes: Amount of independently locked LRU segments
+
+    >>> limits = KeyedLimiter(lambda: TokenBucket(1, clock=lambda: 0.0))
+    >>> limits.try_acquire('tenant1'), limits.try_acquire('tenant1')
+    (True, False)
+    >>> limits.try_acquire('tenant2')
+    True
+    """
+    def __init__(self, factory, maxsize=10000, stripes=16):
+        self.factory = factory
+        self.maxsize = maxsize
+        self._stripe_size = max(1, maxsize // stripes)
+        self._stripes = [(_OrderedDict(), _Lock()) for i in range(stripes)]
+
+    def limiter(self, key):
+        """:returns: The limiter for <key>, creating it if needed"""
+        limiters, lock = self._stripes[hash(key) % len(self._stripes)]
+        with lock:
+            try:
+                limiter = limiters[key]
+            except KeyError:
+                limiter = limiters[key] = self.factory()
+                if len(limiters) > self._stripe_size:
+                    limiters.popitem(last=False)
+            else:
+                limiters.move_to_end(key)
+        return limiter
+
+    def try_acquire(self, key, n=1):
+        """See :py:meth:`TokenBucket.try_acquire`"""
+        return self.limiter(key).try_acquire(n)
+
+    def acquire(self, key, n=1, timeout=None):
+        """See :py:meth:`TokenBucket.acquire`"""
+        return self.limiter(key).acquire(n, timeout)
+
+    def acquire_async(self, key, n=1, timeout=None):
+        """See :py:meth:`TokenBucket.acquire_async`"""
+        return self.limiter(key).acquire_async(n, timeout)
+
+    def __len__(self):
+        return sum(len(limiters) for limiters, lock in self._stripes)
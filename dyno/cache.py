@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 """Cache: a automated caching layer"""
 
-from collections import MutableMapping as _MutableMapping
-from inspect import getargspec as _getargspec
-from itertools import chain as _chain
+from collections.abc import MutableMapping as _MutableMapping
+from copy import copy as _copy
+from inspect import getfullargspec as _getfullargspec, signature as _signature, Parameter as _Parameter
+from operator import itemgetter as _itemgetter
 from functools import wraps as _wraps
 from random import random as _random
-from time import time as now
+from math import inf as _inf, log as _log
+from time import time as now, perf_counter as _perf_counter
 import logging as _logging
 
 log = _logging.getLogger('dyno.cache')
@@ -15,6 +17,8 @@ MINUTES = 60
 HOURS = MINUTES * 60
 DAYS = HOURS * 24
 
+MISSING = object()
+
 class BaseCache(_MutableMapping):
     """Base class of all cache backends"""
     def __contains__(self, key):
@@ -29,14 +33,239 @@ class BaseCache(_MutableMapping):
     def __delitem__(self, key):
         pass
 
+    def add_tags(self, key, tags):
+        """Associate the entry at <key> with each of <tags>, backends that
+        support tags override this and :py:meth:`invalidate_tag`
+        """
+        raise NotImplementedError('{} does not support tags'.format(self.__class__.__name__))
+
+    def invalidate_tag(self, tag):
+        """Remove every entry associated with <tag>
+
+        :returns: the amount of entries removed
+        :rtype: int
+        """
+        raise NotImplementedError('{} does not support tags'.format(self.__class__.__name__))
+
+def supports_tags(backend):
+    """:returns: True if <backend> implements :py:meth:`BaseCache.add_tags`
+
+    >>> supports_tags(DictCache()), supports_tags({})
+    (True, False)
+    >>> cache({}, tags=['user:{user}'])
+    Traceback (most recent call last):
+      ...
+    TypeError: {} does not support tags
+    """
+    add_tags = getattr(type(backend), 'add_tags', None)
+    return add_tags is not None and add_tags is not BaseCache.add_tags
+
 class DictCache(dict):
-    __slots__ = ()
+    """In memory cache backend with a tag index
+
+    Besides the entries two mappings are kept, tag -> keys and key -> tags, so 
+    invalidating a tag only touches the entries that carry it
+
+    >>> backend = DictCache()
+    >>> backend['a'] = 1; backend['b'] = 2; backend['c'] = 3
+    >>> backend.add_tags('a', ['user:42']); backend.add_tags('b', ['user:42', 'page:1'])
+    >>> backend.invalidate_tag('user:42')
+    2
+    >>> backend
+    DictCache({'c': 3})
+
+    Replacing or removing an entry in any way drops its tags
+
+    >>> backend.add_tags('c', ['user:7'])
+    >>> backend['c'] = 4
+    >>> backend.tags('c')
+    frozenset()
+    >>> backend.add_tags('c', ['user:7'])
+    >>> backend.popitem()
+    ('c', 4)
+    >>> backend.invalidate_tag('user:7'), backend._tags, backend._key_tags
+    (0, {}, {})
+    """
+    __slots__ = ('_tags', '_key_tags')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # tag -> set of keys
+        self._tags = {}
+        # key -> set of tags
+        self._key_tags = {}
+
+    def add_tags(self, key, tags):
+        """Associate the entry at <key> with each of <tags>"""
+        key_tags = self._key_tags.get(key)
+        if key_tags is None:
+            key_tags = self._key_tags[key] = set()
+        for tag in tags:
+            key_tags.add(tag)
+            keys = self._tags.get(tag)
+            if keys is None:
+                keys = self._tags[tag] = set()
+            keys.add(key)
+
+    def _untag(self, key):
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate_tag(self, tag):
+        """Remove every entry associated with <tag>
+
+        :returns: the amount of entries removed
+        :rtype: int
+        """
+        removed = 0
+        for key in self._tags.pop(tag, ()):
+            self._untag(key)
+            if dict.pop(self, key, MISSING) is not MISSING:
+                removed += 1
+        return removed
+
+    def tags(self, key):
+        """:returns: the tags associated with <key>"""
+        return frozenset(self._key_tags.get(key, ()))
+
+    def __setitem__(self, key, val):
+        # the new value starts without the old value's tags
+        if self._key_tags:
+            self._untag(key)
+        dict.__setitem__(self, key, val)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        if self._key_tags:
+            self._untag(key)
+
+    def pop(self, key, *default):
+        val = dict.pop(self, key, *default)
+        if self._key_tags:
+            self._untag(key)
+        return val
+
+    def popitem(self):
+        key, val = dict.popitem(self)
+        if self._key_tags:
+            self._untag(key)
+        return key, val
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return dict.__getitem__(self, key)
+        self[key] = default
+        return default
+
+    # dict's versions of these don't go through __setitem__
+    update = _MutableMapping.update
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        dict.clear(self)
+        self._tags.clear()
+        self._key_tags.clear()
+
     def __repr__(self):
         return "{}({})".format(self.__class__.__name__, dict.__repr__(self))
 
-def cache(backend, keys=[], lifetime=None):
+class CachedError:
+    """An exception stored in the cache in place of a value, kept apart from
+    functions that return exception objects
+
+    Each hit raises a copy of the exception, raising the stored one would chain
+    whatever the caller was handling onto it and share that with every later hit
+
+    >>> cached = CachedError(ValueError('bad'))
+    >>> try:
+    ...     try:
+    ...         raise KeyError('handling')
+    ...     except KeyError:
+    ...         cached.reraise()
+    ... except ValueError as err:
+    ...     err is cached.error, err.__context__ is not None
+    (False, True)
+    >>> cached.error.__context__ is None
+    True
+    """
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+    def reraise(self):
+        error = self.error
+        try:
+            error = _copy(error)
+        except Exception:
+            # __init__ takes different arguments to the ones stored in args,
+            # build the copy without calling it
+            cls = error.__class__
+            copied = cls.__new__(cls, *error.args)
+            copied.args = error.args
+            copied.__dict__.update(error.__dict__)
+            error = copied
+        error.__context__ = error.__cause__ = None
+        raise error.with_traceback(None)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.error)
+
+class Tagged:
+    """Return this from a function wrapped with :py:func:`cache` to tag the cached
+    entry, the caller gets <value>
+
+    :param value: the value to return and cache
+    :param tags: tags to associate the entry with, see :py:meth:`DictCache.invalidate_tag`
+    """
+    __slots__ = ('value', 'tags')
+
+    def __init__(self, value, tags):
+        self.value = value
+        self.tags = tags
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(self.__class__.__name__, self.value, self.tags)
+
+def is_empty(output):
+    """:returns: True if <output> is None or an empty container
+    :rtype: bool
+    """
+    if output is None:
+        return True
+    try:
+        return len(output) == 0
+    except TypeError:
+        return False
+
+def cache(backend, keys=[], lifetime=None, empty_lifetime=None, error_lifetime=None,
+          errors=Exception, tags=None):
     """Cache the output of a function based on the keys specified in keys for the specified lifetime
     
+    >>> calls = []
+    >>> @cache(DictCache(), lifetime=60, empty_lifetime=5, error_lifetime=1)
+    ... def search(term):
+    ...     calls.append(term)
+    ...     if term == 'bad':
+    ...         raise ValueError(term)
+    ...     return []
+    >>> search('nothing'), search('nothing')
+    ([], [])
+    >>> for i in range(2):
+    ...     try:
+    ...         search('bad')
+    ...     except ValueError:
+    ...         pass
+    >>> calls
+    ['nothing', 'bad']
+
     :param backend: The cache backend to cache values in, subclass of :py:class:`BaseCache`
     :type backend: A Cache backend
     :param keys: The keys of the args in the funciton to cache on. if the list is 
@@ -46,60 +275,275 @@ def cache(backend, keys=[], lifetime=None):
                      before being cached. if a callable, call the function on each 
                      request and if False is returned, recalculate the value 
                      and reprime the cache. if None, cache the value forever.
+                     see :py:func:`xfetch_timeout` to refresh expensive values early
     :type lifetime: int/float or callable or None
+    :param empty_lifetime: (optional) lifetime of None and empty results, usually 
+                           shorter than <lifetime> (Default: the same as <lifetime>)
+    :param error_lifetime: (optional) if given exceptions raised by the function are
+                           cached for this lifetime and raised again on each hit
+                           without calling the function (Default: not cached)
+    :param errors: exception type(s) to cache when <error_lifetime> is given
+    :param tags: (optional) tags for each entry so it can be removed with 
+                 <backend>.invalidate_tag(), either templates formatted with the
+                 function's arguments eg ['user:{user_id}'] or a function called
+                 with the same arguments returning the tags. the function can
+                 also tag an entry by returning a :py:class:`Tagged` value.
+                 raises TypeError if <backend> does not support tags, see 
+                 :py:func:`supports_tags`
+
+    Entries are stored in the backend as (expiry, output, delta) where delta is the
+    amount of seconds it took to calculate output and output is a 
+    :py:class:`CachedError` for a cached exception
     """
-    def outer(func):
-        # we use lifetime_func here so we don't shadow the global
-        # and get a 'referenced before assignment' error
-        if isinstance(lifetime, (int, float)):
-            lifetime_func = static_timeout(lifetime)
-        else:
-            lifetime_func = lifetime
-        
-        argspec = _getargspec(func)
+    tagging = supports_tags(backend)
+    if tags is not None and not tagging:
+        raise TypeError('{!r} does not support tags'.format(backend))
 
-        cacheable_keys = keys
-        if not keys:
-            cacheable_keys = argspec.args
+    def outer(func):
+        lifetime_func = lifetime_function(lifetime)
+        empty_func = lifetime_function(empty_lifetime) if empty_lifetime is not None else None
+        error_func = lifetime_function(error_lifetime) if error_lifetime is not None else None
+        make_key = key_builder(func, keys)
+        make_tags = tag_builder(func, tags)
         
         @_wraps(func)
         def inner(*args, **kwargs):
-            # as zip terminates as soon as one iterator is exausted we dont
-            # have to worry about the case where some args are specified and
-            # some use thier default value as the len(args) (ie the specified 
-            # args) will cause automatic termination
-            args_mapping = zip(argspec.args, args)
-            
-            cache_keys = []
-            for key, item in _chain(args_mapping, kwargs.items()):
-                if key in cacheable_keys:
-                    cache_keys.append((key, item))
-            # lists are unhashable and cant be used as dict keys
-            cache_keys.sort()
-            cache_keys = tuple(val for key, val in cache_keys)
+            cache_keys = make_key(args, kwargs)
             
             recalculate = False
-            cached = backend.get(cache_keys)
-            if cached:
-                expiry, output = cached
-                expire = lifetime_func(expiry)
+            cached = backend.get(cache_keys, MISSING)
+            if cached is not MISSING:
+                expiry, output, delta = cached
+                if empty_func is None and error_func is None:
+                    expire = lifetime_func(expiry, delta)
+                else:
+                    expire = entry_lifetime(output, lifetime_func, empty_func, error_func)(expiry, delta)
                 if expire:
                     recalculate = True
+                elif type(output) is CachedError:
+                    output.reraise()
             else:
                 recalculate = True
                     
             if recalculate:
-                output = func(*args, **kwargs)
-                expiry = lifetime_func()
-                backend[cache_keys] = expiry, output
+                start = _perf_counter()
+                try:
+                    output = func(*args, **kwargs)
+                except errors as err:
+                    if error_func is not None:
+                        delta = _perf_counter() - start
+                        backend[cache_keys] = error_func(None, delta), CachedError(err), delta
+                        entry_tags = make_tags(args, kwargs)
+                        if entry_tags:
+                            backend.add_tags(cache_keys, entry_tags)
+                    raise
+                delta = _perf_counter() - start
+                entry_tags = make_tags(args, kwargs)
+                if type(output) is Tagged:
+                    if not tagging:
+                        raise TypeError('{!r} does not support tags'.format(backend))
+                    entry_tags = list(entry_tags) + list(output.tags)
+                    output = output.value
+                if empty_func is not None and is_empty(output):
+                    expiry = empty_func(None, delta)
+                else:
+                    expiry = lifetime_func(None, delta)
+                backend[cache_keys] = expiry, output, delta
+                if entry_tags:
+                    backend.add_tags(cache_keys, entry_tags)
 
             return output
         return inner
     return outer
 
+def entry_lifetime(output, lifetime_func, empty_func=None, error_func=None):
+    """:returns: the lifetime function that applies to an entry holding <output>"""
+    if error_func is not None and type(output) is CachedError:
+        return error_func
+    if empty_func is not None and is_empty(output):
+        return empty_func
+    return lifetime_func
+
+def key_builder(func, keys=()):
+    """Build a function that turns the arguments of a call to <func> into a cache key
+
+    >>> def get(user, page=1, verbose=False):
+    ...     pass
+    >>> key = key_builder(get, ['user', 'page'])
+    >>> key(('bob',), {'page': 2, 'verbose': True})
+    (2, 'bob')
+    >>> key(('bob', 2, True), {})
+    (2, 'bob')
+
+    Keyword only arguments are part of the key too, as are the extra positional and
+    keyword arguments of a function taking *args or **kwargs when no <keys> are
+    given. every named argument has its own place in the key, arguments that were
+    not passed hold :py:data:`MISSING` so f(a=1) and f(b=1) never share a key
+
+    >>> def search(term, *, page=1):
+    ...     pass
+    >>> key = key_builder(search)
+    >>> key(('bob',), {'page': 2}) == key(('bob',), {'page': 3})
+    False
+    >>> def price(*items, **options):
+    ...     pass
+    >>> key = key_builder(price)
+    >>> key(('apple',), {}), key(('pear',), {'currency': 'EUR'})
+    ((('apple',), ()), (('pear',), (('currency', 'EUR'),)))
+
+    :param func func: The function whose arguments make up the key
+    :param keys: The names of the arguments to use, all of them if empty
+    :type keys: list of strings
+    :returns: function(args, kwargs) returning a hashable key
+    """
+    spec = _getfullargspec(func)
+    argnames = spec.args
+    named = frozenset(argnames + spec.kwonlyargs)
+    # the key holds the cacheable arguments in name order
+    names = sorted(keys or named)
+    slots = {name: slot for slot, name in enumerate(names)}
+    # extra arguments are only part of the key when all the arguments are
+    varargs = not keys and spec.varargs is not None
+    varkw = not keys and spec.varkw is not None
+    # amount of positional args -> itemgetter picking each slot's argument out of
+    # args + (MISSING,), or None if the key is the positional args as is
+    positions = {}
+    pad = (MISSING,)
+
+    def make_key(args, kwargs):
+        if not kwargs:
+            try:
+                getter = positions[len(args)]
+            except KeyError:
+                passed = argnames[:len(args)]
+                order = tuple(passed.index(name) if name in passed else len(args) for name in names)
+                if order == tuple(range(len(args))):
+                    getter = None
+                elif len(order) > 1:
+                    getter = _itemgetter(*order)
+                else:
+                    # itemgetter returns a single item rather than a tuple
+                    def getter(args, order=order):
+                        return tuple(args[i] for i in order)
+                positions[len(args)] = getter
+            key = args if getter is None else getter(args + pad)
+            if varargs:
+                key += (args[len(argnames):],)
+            if varkw:
+                key += ((),)
+            return key
+
+        values = [MISSING] * len(names)
+        for name, val in zip(argnames, args):
+            slot = slots.get(name)
+            if slot is not None:
+                values[slot] = val
+        extra = []
+        for name, val in kwargs.items():
+            slot = slots.get(name)
+            if slot is not None:
+                values[slot] = val
+            elif varkw and name not in named:
+                extra.append((name, val))
+        if varargs:
+            values.append(args[len(argnames):])
+        if varkw:
+            # sorted by name only, the values may not be comparable
+            extra.sort(key=_itemgetter(0))
+            values.append(tuple(extra))
+        return tuple(values)
+    return make_key
+
+def tag_builder(func, tags=None):
+    """Build a function that works out the tags of an entry from the arguments
+    of a call to <func>
+
+    >>> def get(user, page=1):
+    ...     pass
+    >>> make_tags = tag_builder(get, ['user:{user}', 'page:{page}'])
+    >>> make_tags(('bob',), {})
+    ['user:bob', 'page:1']
+
+    :param func func: The function whose arguments the tags are made from
+    :param tags: templates formatted with the arguments, a function called with the
+                 arguments returning the tags or None for no tags
+    :returns: function(args, kwargs) returning a list of tags
+    """
+    if tags is None:
+        def make_tags(args, kwargs):
+            return ()
+    elif callable(tags):
+        def make_tags(args, kwargs):
+            return list(tags(*args, **kwargs))
+    else:
+        templates = list(tags)
+        signature = _signature(func)
+        def make_tags(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            return [template.format(**arguments) for template in templates]
+    return make_tags
+
+def lifetime_function(lifetime):
+    """Turn the <lifetime> argument of :py:func:`cache` into a lifetime function
+
+    :param lifetime: seconds, a lifetime function or None for forever
+    :returns: function(expiry=None, delta=0) as described in :py:func:`static_timeout`
+
+    Lifetimes may be any callable, lifetimes taking only <expiry> are wrapped so 
+    they can be called with <delta> too
+
+    >>> class Budget:
+    ...     def __init__(self, seconds):
+    ...         self.seconds = seconds
+    ...     def __call__(self, expiry=None, delta=0):
+    ...         return self.seconds - delta if expiry is None else False
+    >>> lifetime_function(Budget(10))(None, 4)
+    6
+    >>> class Fixed:
+    ...     def __call__(self, expiry=None):
+    ...         return 'old style'
+    >>> lifetime_function(Fixed())(None, 4)
+    'old style'
+    """
+    if isinstance(lifetime, (int, float)):
+        return static_timeout(lifetime)
+    elif lifetime is None:
+        return forever
+    
+    try:
+        parameters = _signature(lifetime).parameters.values()
+    except (TypeError, ValueError):
+        return lifetime
+    kinds = [param.kind for param in parameters]
+    positional = sum(kind in (_Parameter.POSITIONAL_ONLY, _Parameter.POSITIONAL_OR_KEYWORD)
+                     for kind in kinds)
+    if positional < 2 and _Parameter.VAR_POSITIONAL not in kinds:
+        # lifetime functions written before delta was passed in
+        @_wraps(lifetime)
+        def wrapped(expiry=None, delta=0):
+            return lifetime(expiry)
+        return wrapped
+    return lifetime
+
+def forever(expiry=None, delta=0):
+    """Never recache the value"""
+    if expiry is None:
+        return _inf
+    return False
+
 def static_timeout(timeout):
-    """Recache the value after a specifed ammount of time has passed"""
-    def wrapped(expiry=None):
+    """Recache the value after a specifed ammount of time has passed
+
+    A lifetime function is called with no expiry when a value has just been 
+    calculated and returns when it expires. it is called with the stored expiry
+    when the value is read from the cache and returns False if the value is still
+    valid or the new expiry if it should be recalculated. <delta> is the amount of 
+    seconds it took to calculate the value, cost aware lifetimes such as 
+    :py:func:`xfetch_timeout` use it
+    """
+    def wrapped(expiry=None, delta=0):
         if expiry is None:
             # we want the next expiry
             return now() + timeout
@@ -124,16 +568,16 @@ def linear_timeout(timeout):
       0% +------|----
          0  Time -->
     """
-    def wrapped(expiry=None):
+    def wrapped(expiry=None, delta=0):
         if expiry is None:
             # we want the next expiry
             return now() + timeout
         else:
             # we want to know if we should expire and its expiry time
             start = expiry - timeout
-            delta = now() - start
-            threshold = delta/timeout
-            cache = last + timeout if _random() < threshold else False
+            current = now()
+            threshold = (current - start)/timeout
+            cache = current + timeout if _random() < threshold else False
             return cache
     return wrapped
 
@@ -150,16 +594,48 @@ def exponential_timeout(timeout, exponent=2):
       0% +-------------|-
          0  Time -->
     """
-    def wrapped(expiry=None):
+    def wrapped(expiry=None, delta=0):
         if expiry is None:
             # we want the next expiry
             return now() + timeout
         else:
             # we want to know if we should expire and its expiry time
             start = expiry - timeout
-            delta = now() - start
-            val = delta/timeout
+            current = now()
+            val = (current - start)/timeout
             threshold = val ** exponent
-            cache = last + timeout if _random() < threshold else False
+            cache = current + timeout if _random() < threshold else False
             return cache
     return wrapped
+
+def xfetch_timeout(timeout, beta=1.0):
+    """Recalculate the value early with a chance that grows as it nears its expiry
+    and with how long it took to calculate (the XFetch algorithm)
+
+    The value is recalculated once now - delta * beta * log(random()) passes the
+    expiry. as log(random()) is negative the check looks into the future by a 
+    random amount proportional to delta, so a value that takes seconds to calculate
+    is usually refreshed a few seconds before it expires while a value that takes
+    microseconds is left alone until it very nearly does. on average only one 
+    caller recalculates a value which avoids a dog pile on expiry
+
+    >>> lifetime = xfetch_timeout(60)
+    >>> expiry = lifetime(None, delta=0.001)
+    >>> lifetime(expiry, delta=0.001) # fresh and cheap to calculate
+    False
+    >>> lifetime(expiry - 60, delta=0.001) is not False # expired
+    True
+
+    :param float timeout: seconds the value is valid for
+    :param float beta: values above 1.0 favour recalculating earlier, below 1.0 later
+    """
+    def wrapped(expiry=None, delta=0):
+        current = now()
+        if expiry is None:
+            # we want the next expiry
+            return current + timeout
+        # 1.0 - random() is never 0 so the log is always defined
+        if current - delta * beta * _log(1.0 - _random()) >= expiry:
+            return current + timeout
+        return False
+    return wrapped
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""Command: protect a call with caching, a circuit breaker, a concurrency limit,
+retries and metrics in a single wrapper
+
+Stacking :py:func:`dyno.harness.harness`, :py:func:`dyno.cache.cache`, a
+:py:class:`dyno.breaker.AutoBreaker`, a :py:class:`dyno.breaker.Limiter`,
+:py:func:`dyno.retry.retry` and a :py:class:`dyno.metrics.Metrics` costs a
+wrapper frame, an argument repack and a clock read per layer. :py:func:`command`
+builds all the stages from one declarative policy into a single wrapper that
+reads the clock once when the call starts and once when it finishes. the breaker
+trips on the same rolling window that the metrics report
+
+>>> from dyno.cache import DictCache
+>>> from dyno.metrics import Metrics
+>>> metrics = Metrics()
+>>> @command(cache=DictCache(), lifetime=60, breaker={'volume_threshold': 2},
+...          limiter=10, retry=3, metrics=metrics)
+... def lookup(name):
+...     return name.upper()
+>>> lookup('bob')
+'BOB'
+>>> lookup('bob') # served from the cache
+'BOB'
+>>> metrics.successes
+1
+>>> lookup.breaker.window is metrics.window
+True
+
+>>> @command(breaker={'volume_threshold': 2, 'health_interval': 0})
+... def down():
+...     raise IOError('connection refused')
+>>> for i in range(2):
+...     try:
+...         down()
+...     except IOError:
+...         pass
+>>> down()
+Traceback (most recent call last):
+  ...
+dyno.breaker.Broken
+
+A call shed by the limiter never reaches the breaker, so it can't take the breaker's
+single trial request with it
+
+>>> t = [0.0]
+>>> limiter = Limiter(1)
+>>> @command(breaker=AutoBreaker(volume_threshold=1, health_interval=0, clock=lambda: t[0]),
+...          limiter=limiter, clock=lambda: t[0])
+... def ping():
+...     return 'pong'
+>>> ping.breaker.failure()
+>>> t[0] = 10.0 # past the sleep window
+>>> with limiter:
+...     ping()
+Traceback (most recent call last):
+  ...
+dyno.breaker.RateLimited
+>>> ping(), ping.breaker.state
+('pong', 'closed')
+
+Exceptions that escape once every attempt failed are reported after they are raised
+so an :py:class:`dyno.harness.Aggregator` can tell failures in different functions apart
+
+>>> import io, logging
+>>> from dyno.harness import Aggregator
+>>> stream = io.StringIO()
+>>> logger = logging.getLogger('dyno.command.example')
+>>> logger.addHandler(logging.StreamHandler(stream))
+>>> logger.propagate = False
+>>> aggregator = Aggregator(logger, interval=3600)
+>>> @command(retry=2, aggregator=aggregator)
+... def parse():
+...     raise ValueError('bad input')
+>>> @command(retry=2, aggregator=aggregator)
+... def lookup():
+...     raise KeyError('missing')
+>>> for call in (parse, lookup):
+...     try:
+...         call()
+...     except Exception:
+...         pass
+>>> aggregator.flush()
+>>> output = stream.getvalue()
+>>> 'ValueError: bad input' in output, "KeyError: 'missing'" in output
+(True, True)
+>>> aggregator.close()
+
+Retry deadlines are measured with the same clock as everything else
+
+>>> t = [0.0]
+>>> attempts = []
+>>> @command(retry=Policy(3, deadline=10), clock=lambda: t[0])
+... def unreachable():
+...     attempts.append(t[0])
+...     raise IOError('no route to host')
+>>> try:
+...     unreachable()
+... except IOError:
+...     pass
+>>> len(attempts)
+3
+
+A call that fails counts as a drop for an :py:class:`AdaptiveLimiter` whether or
+not it was retried
+
+>>> from dyno.breaker import AIMD
+>>> @command(limiter=AdaptiveLimiter(10, AIMD()))
+... def flaky():
+...     raise IOError('connection reset')
+>>> try:
+...     flaky()
+... except IOError:
+...     pass
+>>> flaky.limiter.limit
+9
+
+Slow calls can be sampled by a :py:class:`dyno.watchdog.Watchdog`
+
+>>> from time import sleep
+>>> from dyno.watchdog import Watchdog
+>>> watchdog = Watchdog(threshold=0.01, interval=0.005)
+>>> @command(retry=2, watchdog=watchdog, name='db')
+... def slow_query():
+...     sleep(0.1)
+>>> slow_query()
+>>> watchdog.stop()
+>>> count, stack = watchdog.report('db')[0]
+>>> stack[-1][2]
+'slow_query'
+"""
+from functools import wraps as _wraps
+from time import monotonic as _monotonic
+import logging as _logging
+
+from dyno.breaker import AutoBreaker, Limiter, AdaptiveLimiter, Broken, RateLimited
+from dyno.cache import (Tagged, MISSING as _MISSING, CachedError as _CachedError,
+                        is_empty as _is_empty, entry_lifetime as _entry_lifetime,
+                        key_builder as _key_builder, tag_builder as _tag_builder,
+                        lifetime_function as _lifetime_function, supports_tags as _supports_tags)
+from dyno.retry import Policy, make_compound_exception
+
+log = _logging.getLogger('dyno.command')
+
+def command(cache=None, keys=(), lifetime=None, empty_lifetime=None, error_lifetime=None,
+            tags=None, breaker=None, limiter=None, retry=None, metrics=None, aggregator=None, logger=None,
+            watchdog=None, name=None, clock=_monotonic):
+    """Wrap a function in every stage named in the policy, stages that are not
+    configured cost nothing
+
+    The stages run in this order: cache lookup, concurrency limit, breaker check,
+    attempts (retried according to <retry>), recording the outcome, storing the
+    result in the cache. each failed attempt is recorded against the breaker and
+    retrying stops early if the breaker opens
+
+    :param cache: (optional) cache backend, see :py:func:`dyno.cache.cache`
+    :param keys: The names of the arguments to cache on, all of them if empty
+    :param lifetime: How long cached values are valid, see :py:func:`dyno.cache.cache`
+    :param empty_lifetime: (optional) How long None and empty results are valid
+    :param error_lifetime: (optional) How long to cache the exception raised once
+                           every attempt failed, see :py:func:`dyno.cache.cache`
+    :param tags: (optional) tags for each cached entry, see :py:func:`dyno.cache.cache`
+    :param breaker: (optional) an :py:class:`AutoBreaker`, a dict of arguments to
+                    build one, or True to build one with the defaults
+    :param limiter: (optional) a :py:class:`Limiter` or :py:class:`AdaptiveLimiter`
+                    or the maximum amount of calls in flight
+    :param retry: (optional) a :py:class:`dyno.retry.Policy` or the amount of attempts
+    :param Metrics metrics: (optional) metrics to record outcomes in, a breaker
+                            built by this function shares its window
+    :param Aggregator aggregator: (optional) report exceptions that escape to an
+                                  :py:class:`dyno.harness.Aggregator`
+    :param logging.Logger logger: (optional) log exceptions that escape to this logger,
+                                  ignored if <aggregator> is given
+    :param Watchdog watchdog: (optional) track the attempts of each call in a
+                              :py:class:`dyno.watchdog.Watchdog` so slow calls are sampled
+    :param str name: (optional) name to report samples under in <watchdog>
+                     (Default: the qualified name of the function)
+    :param clock: function returning the current time in seconds
+    :returns: decorator, the wrapped function has :py:attr:`breaker`,
+              :py:attr:`limiter`, :py:attr:`policy` and :py:attr:`metrics` attributes
+    """
+    if isinstance(breaker, dict):
+        breaker = dict(breaker)
+        if metrics is not None:
+            breaker.setdefault('window', metrics.window)
+        breaker.setdefault('clock', clock)
+        breaker = AutoBreaker(**breaker)
+    elif breaker is True:
+        breaker = AutoBreaker(window=None if metrics is None else metrics.window, clock=clock)
+    elif breaker is not None and metrics is not None and breaker.window is not metrics.window:
+        log.warning('%r does not share its window with %r, outcomes will only be '
+                    'reported to the breaker', breaker, metrics)
+
+    tagging = cache is not None and _supports_tags(cache)
+    if tags is not None and not tagging:
+        raise TypeError('{!r} does not support tags'.format(cache))
+
+    if isinstance(limiter, int):
+        limiter = Limiter(limiter)
+    if isinstance(retry, int):
+        retry = Policy(retry)
+
+    if breaker is not None:
+        window = breaker.window
+    elif metrics is not None:
+        window = metrics.window
+    else:
+        window = None
+
+    def outer(func):
+        empty_func = error_func = None
+        if cache is not None:
+            lifetime_func = _lifetime_function(lifetime)
+            empty_func = _lifetime_function(empty_lifetime) if empty_lifetime is not None else None
+            error_func = _lifetime_function(error_lifetime) if error_lifetime is not None else None
+            special = empty_func is not None or error_func is not None
+            make_key = _key_builder(func, keys)
+            make_tags = _tag_builder(func, tags)
+        adaptive = isinstance(limiter, AdaptiveLimiter)
+        if watchdog is not None:
+            service_name = name or getattr(func, '__qualname__', type(func).__qualname__)
+        times = 1 if retry is None else retry.times
+        budget = None if retry is None else retry.budget
+
+        def store_error(key, err, delta, args, kwargs):
+            cache[key] = error_func(None, delta), _CachedError(err), delta
+            entry_tags = make_tags(args, kwargs)
+            if entry_tags:
+                cache.add_tags(key, entry_tags)
+
+        def report(err):
+            if aggregator is not None:
+                aggregator.report(func, err)
+            elif logger is not None:
+                logger.error('Exception in %s', func, exc_info=err)
+
+        @_wraps(func)
+        def wrapper(*args, **kwargs):
+            if cache is not None:
+                key = make_key(args, kwargs)
+                cached = cache.get(key, _MISSING)
+                if cached is not _MISSING:
+                    expiry, output, delta = cached
+                    if special:
+                        expire = _entry_lifetime(output, lifetime_func, empty_func, error_func)(expiry, delta)
+                    else:
+                        expire = lifetime_func(expiry, delta)
+                    if not expire:
+                        if type(output) is _CachedError:
+                            output.reraise()
+                        return output
+
+            start = clock()
+            # the limiter goes first, a breaker letting a trial request through
+            # expects to hear how it went and a request shed here never would
+            if limiter is not None:
+                try:
+                    token = limiter.acquire()
+                except RateLimited:
+                    if window is not None:
+                        window.add('rejected', now=start)
+                    raise
+
+            if breaker is not None and not breaker.allow_request(start):
+                if limiter is not None:
+                    limiter.cancel(token)
+                raise Broken()
+
+            if budget is not None:
+                budget.request()
+            errors = []
+            failed = False
+            began = start
+            delay = 0
+            if watchdog is not None:
+                watch = watchdog.enter(service_name)
+            try:
+                for attempt in range(1, times + 1):
+                    try:
+                        output = func(*args, **kwargs)
+                    except Exception as err:
+                        end = clock()
+                        failed = True
+                        if breaker is not None:
+                            breaker.failure(end)
+                        elif window is not None:
+                            window.add('failure', now=end)
+                        if retry is None or not retry.retryable(err):
+                            if error_func is not None:
+                                store_error(key, err, end - began, args, kwargs)
+                            report(err)
+                            raise
+                        log.debug('%s raised an exception (%s) on attempt %d/%d', func, err, attempt, times)
+                        if errors and not retry.keep_tracebacks:
+                            errors[-1].__traceback__ = None
+                        errors.append(err)
+                    else:
+                        end = clock()
+                        if breaker is not None:
+                            breaker.success(end, end - began)
+                        elif window is not None:
+                            window.add('success', now=end)
+                        if cache is not None:
+                            delta = end - began
+                            entry_tags = make_tags(args, kwargs)
+                            if type(output) is Tagged:
+                                if not tagging:
+                                    raise TypeError('{!r} does not support tags'.format(cache))
+                                entry_tags = list(entry_tags) + list(output.tags)
+                                output = output.value
+                            if empty_func is not None and _is_empty(output):
+                                cache[key] = empty_func(None, delta), output, delta
+                            else:
+                                cache[key] = lifetime_func(None, delta), output, delta
+                            if entry_tags:
+                                cache.add_tags(key, entry_tags)
+                        return output
+
+                    delay = retry.next_delay(attempt, delay, start, end)
+                    if delay is None:
+                        break
+                    if delay:
+                        retry.sleep(delay)
+                    began = end + delay
+                    if breaker is not None and not breaker.allow_request(began):
+                        log.debug('Not retrying %s, %r is open', func, breaker)
+                        break
+            finally:
+                if watchdog is not None:
+                    watchdog.exit(watch)
+                if limiter is not None:
+                    if adaptive:
+                        limiter.release(token, dropped=failed)
+                    else:
+                        limiter.release()
+
+            log.debug('%s failed %d times, aborting', func, len(errors))
+            compound_err = make_compound_exception(errors)
+            if error_func is not None:
+                store_error(key, compound_err, end - start, args, kwargs)
+            # reported once raised so it has a traceback to be told apart by
+            try:
+                raise compound_err from errors[-1]
+            except Exception:
+                report(compound_err)
+                raise
+
+        wrapper.breaker = breaker
+        wrapper.limiter = limiter
+        wrapper.policy = retry
+        wrapper.metrics = metrics
+        return wrapper
+    return outer
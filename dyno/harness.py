@@ -1,15 +1,206 @@
 #!/usr/bin/env python3
 """Harness: An Error/Exception reporting framework
+
+:py:func:`harness`: decorator that logs exceptions raised by a function and re-raises them
+:py:class:`Aggregator`: deduplicates the exceptions reported by :py:func:`harness` so an
+                        outage doesn't turn into a flood of identical tracebacks
+
+>>> import io
+>>> stream = io.StringIO()
+>>> logger = _logging.getLogger('dyno.harness.example')
+>>> logger.addHandler(_logging.StreamHandler(stream))
+>>> logger.propagate = False
+>>> aggregator = Aggregator(logger, interval=3600)
+>>> @harness(aggregator=aggregator)
+... def fail():
+...     raise ValueError('boom')
+>>> for i in range(100):
+...     try:
+...         fail()
+...     except ValueError:
+...         pass
+>>> aggregator.flush()
+>>> stream.getvalue().count('Traceback')
+1
+>>> 'ValueError raised 100 times' in stream.getvalue()
+True
+>>> aggregator.close()
 """
+from collections import OrderedDict as _OrderedDict
 from functools import wraps as _wraps
+from random import random as _random
+from threading import Lock as _Lock, Thread as _Thread
+from time import monotonic as _monotonic
 import logging as _logging
+import queue as _queue
+
+from dyno.retry import CompoundException as _CompoundException
+
+def fingerprint(err):
+    """Identify an exception by its type and the line that raised it
+
+    A :py:class:`dyno.retry.CompoundException` is identified by the last error
+    it wraps, otherwise every retried function would share the line in retry
+    that raises it
+
+    >>> from dyno.retry import make_compound_exception
+    >>> def fail():
+    ...     raise KeyError('missing')
+    >>> try:
+    ...     fail()
+    ... except KeyError as err:
+    ...     error = err
+    >>> fingerprint(make_compound_exception([error])) == fingerprint(error)
+    True
+
+    :param Exception err: The exception to fingerprint
+    :returns: (exception type name, filename, line number)
+    :rtype: tuple
+    """
+    while isinstance(err, _CompoundException) and len(err):
+        err = err._errors[-1]
+    tb = err.__traceback__
+    if tb is None:
+        return (type(err).__qualname__, None, None)
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    return (type(err).__qualname__, tb.tb_frame.f_code.co_filename, tb.tb_lineno)
+
+class Aggregator:
+    """Log the first occurrence of each distinct exception in full and periodic
+    counts of the repeats
+
+    Exceptions are grouped by :py:func:`fingerprint`. reporting an exception only
+    counts it and (for the first occurrence or a sampled repeat) queues it, the
+    traceback is formatted and written by a background thread so the thread that
+    raised the exception isn't slowed down. if the queue is full the traceback is
+    dropped but the exception is still counted
+
+    :param logging.Logger logger: logger to write to, must provide error and warning
+    :param float interval: seconds between summaries of repeated exceptions
+    :param float sample_rate: fraction (0.0 to 1.0) of repeats to log with a full traceback
+    :param int queue_size: maximum amount of tracebacks waiting to be written
+    :param int max_fingerprints: maximum amount of distinct exceptions to remember,
+                                 the least recently seen are forgotten first
+    """
+    _FLUSH = object()
+
+    def __init__(self, logger=_logging.getLogger('dyno.harness'), interval=60,
+                 sample_rate=0.0, queue_size=1000, max_fingerprints=1000):
+        self.logger = logger
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.max_fingerprints = max_fingerprints
+        self.dropped = 0
+
+        self._lock = _Lock()
+        # fingerprint -> count since the last summary
+        self._counts = {}
+        # fingerprints that have been logged in full, oldest first
+        self._seen = _OrderedDict()
+        self._queue = _queue.Queue(queue_size)
+        self._thread = None
+        self._closed = False
+
+    def report(self, func, err):
+        """Record an exception raised by <func>"""
+        fp = fingerprint(err)
+        with self._lock:
+            self._counts[fp] = self._counts.get(fp, 0) + 1
+            first = fp not in self._seen
+            if first:
+                self._seen[fp] = func
+                if len(self._seen) > self.max_fingerprints:
+                    self._seen.popitem(last=False)
+            else:
+                self._seen.move_to_end(fp)
+
+        if first:
+            self._put(('first', func, err))
+        elif self.sample_rate and _random() < self.sample_rate:
+            self._put(('sample', func, err))
+
+        if self._thread is None and not self._closed:
+            self._start()
+
+    def _put(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except _queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = _Thread(target=self._run, name='dyno.harness.Aggregator', daemon=True)
+                self._thread.start()
+
+    def _write(self, record):
+        kind, func, err = record
+        exc_info = (type(err), err, err.__traceback__)
+        if kind == 'first':
+            self.logger.error('Exception in %s', func, exc_info=exc_info)
+        else:
+            self.logger.error('Exception in %s (sampled repeat)', func, exc_info=exc_info)
+
+    def summarize(self):
+        """Log the amount of times each exception was raised since the last summary"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            dropped, self.dropped = self.dropped, 0
+        for (name, filename, lineno), count in counts.items():
+            self.logger.warning('%s raised %d times in the last summary period (%s:%s)',
+                                name, count, filename, lineno)
+        if dropped:
+            self.logger.warning('%d tracebacks dropped, the log queue was full', dropped)
+
+    def _run(self):
+        next_summary = _monotonic() + self.interval
+        while True:
+            try:
+                record = self._queue.get(timeout=max(0, next_summary - _monotonic()))
+            except _queue.Empty:
+                record = None
+
+            if record is None or record is self._FLUSH:
+                self.summarize()
+                next_summary = _monotonic() + self.interval
+                if record is self._FLUSH:
+                    self._queue.task_done()
+                    if self._closed:
+                        return
+                continue
+
+            try:
+                self._write(record)
+            except Exception:
+                pass
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Write all queued tracebacks and a summary, waiting until it is done"""
+        if self._thread is None:
+            self._start()
+        self._queue.put(self._FLUSH)
+        self._queue.join()
+
+    def close(self):
+        """Flush and stop the background thread"""
+        self._closed = True
+        if self._thread is not None:
+            self.flush()
+            self._thread.join()
+            self._thread = None
 
-def harness(logger=_logging.getLogger('dyno.harness')):
+def harness(logger=_logging.getLogger('dyno.harness'), aggregator=None):
     """decorator to log any exceptions occuring in function and re-raise them
     
     :param logging.Logger logger: logger function to log to. this implementation
                                   only calls logger.exception and any compatible 
                                   object that provides this method will work
+    :param Aggregator aggregator: (optional) report exceptions to an :py:class:`Aggregator`
+                                  instead of logging every one of them to <logger>
     """
     def outer_wrapper(func):
         @_wraps(func)
@@ -18,7 +209,10 @@ def harness(logger=_logging.getLogger('dyno.harness')):
                 ret = func(*args, **kwargs)
                 return ret
             except Exception as err:
-                logger.exception('Exception in %s', func)
+                if aggregator is not None:
+                    aggregator.report(func, err)
+                else:
+                    logger.exception('Exception in %s', func)
                 raise # let other functions handle this
         return inner_wrapper
     return outer_wrapper
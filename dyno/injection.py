@@ -5,8 +5,19 @@
                         into the decorator and thier values to detirmine what to inject
                         and where. relies on the default values in the actual function
                         for fallback values
-:py:decorator:`inject3`: injection mechanism that uses function annotations and default 
+:py:decorator:`inject3`: injection mechanism that uses function annotations and default
                          values to inject values
+:py:class:`Parallel`: Dependency builder for :py:decorator:`inject` and :py:decorator:`inject3`
+                      that constructs all dependencies at the same time on a worker pool
+:py:class:`Singleton`, :py:class:`PerThread`, :py:class:`PerRequest`, :py:class:`Transient`:
+                      Lifetime scopes that wrap a dependency so the constructed object 
+                      is reused instead of being rebuilt on every call
+:py:func:`request_scope`: Context manager delimiting a request for :py:class:`PerRequest`
+:py:class:`SocketPool`: A pool of idle connections to one endpoint
+:py:func:`pooled_socket`: Like :py:func:`socket` but hands out connections from a shared
+                          :py:class:`SocketPool` for the endpoint
+:py:class:`Resolver`: Caches DNS lookups and remembers which addresses recently failed,
+                      :py:data:`default_resolver` is shared by all socket dependencies
 :py:func:`socket`: A wrapper/constructor around socket.socket and socket.connect to create
                    a connection to a remote server for injection. also serves as an example
                    implementation of a dependency
@@ -20,6 +31,52 @@ Below are some time constants to be used as the timeout value for :py:func:`sock
                           transiting over multiple hops)
 * :py:const:`INTERNET_TIMEOUT`: Timeout value for responsive sites on the internet
 
+When a domain resolves to several addresses the connection attempts are staggered
+by :py:const:`CONNECT_DELAY` (or half the timeout if that is shorter) and raced
+against each other in the style of RFC 8305 (happy eyeballs) so a dead address
+does not cost a whole timeout
+
+Parallel Construction
+'''''''''''''''''''''
+By default dependencies are built one after another. passing a :py:class:`Parallel`
+builder to :py:decorator:`inject` or :py:decorator:`inject3` builds them all at once
+so the time taken is that of the slowest dependency rather than the sum of them all.
+a dependency that takes longer than its timeout is abandoned and the default value
+of the argument is used instead
+
+>>> import time
+>>> def slow(request, key):
+...     time.sleep(0.2)
+...     return key
+>>> @inject(Parallel(timeout=1), a=slow, b=slow)
+... def test(a=None, b=None):
+...     return a + b
+>>> start = time.time()
+>>> test()
+'ab'
+>>> time.time() - start < 0.35
+True
+
+The same happens when a coroutine function is injected, the dependencies are awaited
+without blocking the event loop. an abandoned dependency that finishes later is
+closed if it has a close method
+
+>>> import asyncio
+>>> closed = []
+>>> class Connection:
+...     def close(self):
+...         closed.append(self)
+>>> def slow_connection(request, key):
+...     time.sleep(0.2)
+...     return Connection()
+>>> @inject(Parallel(timeout=0.05), conn=slow_connection)
+... async def handler(conn=None):
+...     return conn
+>>> asyncio.run(handler()) is None
+True
+>>> time.sleep(0.3); len(closed)
+1
+
 Issues
 '''''''
 * in some cases you may want to inject a constructor function into a function but 
@@ -31,10 +88,21 @@ Issues
   constructor and get the expected value
 """
 from dyno.retry import retry as _retry, CompoundException as _CompoundException
+from concurrent import futures as _futures
+from collections import deque as _deque, OrderedDict as _OrderedDict
+from contextlib import contextmanager as _contextmanager
 from functools import wraps as _wraps
+from threading import Lock as _Lock, Condition as _Condition, local as _local
+import contextvars as _contextvars
+from time import monotonic as _monotonic
+import asyncio as _asyncio
+import errno as _errno
 import logging as _logging
+import os as _os
+import selectors as _selectors
 import socket as _socket
 import inspect as _inspect
+import sys as _sys
 
 # Several preset timeout values for convenience
 LOCALHOST_TIMEOUT = 0.05
@@ -42,12 +110,191 @@ LAN_TIMEOUT = 0.05
 DC_TIMEOUT = 0.2
 INTERNET_TIMEOUT = 3
 
+# RFC 8305 recommended delay between starting connection attempts
+CONNECT_DELAY = 0.25
+
 log = _logging.getLogger('dyno.injection')
 # seperate log file for dependencies
 log_dependency = _logging.getLogger('dependencies')
 
-def inject(**dep_kwargs):
-    """.. py:decorator:: inject(**kwargs)
+# worker pool shared by all Parallel builders that don't supply their own
+_executor = None
+_executor_lock = _Lock()
+
+def shared_executor():
+    """:returns: The worker pool used by :py:class:`Parallel` when none is specified
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = _futures.ThreadPoolExecutor(32, thread_name_prefix='dyno.injection')
+    return _executor
+
+def build_deps(obj, deps):
+    """Build each dependency in turn, dependencies that raise an exception are left
+    out so the default value is used
+
+    :param obj: The object the dependencies are being built for
+    :param dict deps: mapping of key to dependency constructor
+    :returns: mapping of key to the constructed dependency
+    :rtype: dict
+    """
+    kwargs = {}
+    for key, dep in deps.items():
+        try:
+            kwargs[key] = dep(obj, key)
+        except Exception as err:
+            log.info('%s dependency (key="%s") raised an exception, '
+                     'using default value. exception: %s', obj, key, err)
+    return kwargs
+
+def _discard(future):
+    """Clean up a dependency that finished after it was abandoned"""
+    if future.cancelled() or future.exception():
+        return
+    close = getattr(future.result(), 'close', None)
+    if close:
+        close()
+
+class Parallel:
+    """Dependency builder that constructs all dependencies concurrently
+
+    :param executor: (optional) a :py:class:`concurrent.futures.Executor` to build 
+                     dependencies on (Default: :py:func:`shared_executor`)
+    :param timeout: (optional) seconds to wait for each dependency before giving up
+                    and using the default value. either a number for all dependencies
+                    or a dict of key to number, keys missing from the dict wait forever
+    :type timeout: int or float or dict
+    """
+    def __init__(self, executor=None, timeout=None):
+        self._executor = executor
+        self.timeout = timeout
+
+    @property
+    def executor(self):
+        return self._executor if self._executor is not None else shared_executor()
+
+    def _timeouts(self, deps):
+        """:returns: (key, timeout) pairs, shortest timeout first"""
+        if isinstance(self.timeout, dict):
+            timeouts = [(key, self.timeout.get(key)) for key in deps]
+        else:
+            timeouts = [(key, self.timeout) for key in deps]
+        timeouts.sort(key=lambda item: float('inf') if item[1] is None else item[1])
+        return timeouts
+
+    def _fallback(self, obj, key, err):
+        if isinstance(err, (_futures.TimeoutError, _asyncio.TimeoutError)):
+            err = 'timed out'
+        log.info('%s dependency (key="%s") raised an exception, '
+                 'using default value. exception: %s', obj, key, err)
+
+    def __call__(self, obj, deps):
+        """Build <deps> for <obj>, see :py:func:`build_deps`"""
+        start = _monotonic()
+        executor = self.executor
+        # run in a copy of our context so request scopes are visible to the workers
+        pending = {key: executor.submit(_contextvars.copy_context().run, dep, obj, key)
+                   for key, dep in deps.items()}
+
+        kwargs = {}
+        for key, timeout in self._timeouts(deps):
+            future = pending[key]
+            remaining = None if timeout is None else max(0, start + timeout - _monotonic())
+            try:
+                kwargs[key] = future.result(remaining)
+            except Exception as err:
+                if not future.done() and not future.cancel():
+                    future.add_done_callback(_discard)
+                self._fallback(obj, key, err)
+
+        return kwargs
+
+    async def build_async(self, obj, deps):
+        """Same as calling the builder but waits for the dependencies without
+        blocking the event loop"""
+        start = _monotonic()
+        executor = self.executor
+        pending = {key: executor.submit(_contextvars.copy_context().run, dep, obj, key)
+                   for key, dep in deps.items()}
+
+        kwargs = {}
+        for key, timeout in self._timeouts(deps):
+            future = pending[key]
+            remaining = None if timeout is None else max(0, start + timeout - _monotonic())
+            try:
+                # shielded so a timeout leaves the build running to be cleaned up below
+                kwargs[key] = await _asyncio.wait_for(_asyncio.shield(_asyncio.wrap_future(future)),
+                                                      remaining)
+            except Exception as err:
+                if not future.done() and not future.cancel():
+                    future.add_done_callback(_discard)
+                self._fallback(obj, key, err)
+
+        return kwargs
+
+def _plan(func, deps):
+    """Work out ahead of time where each dependency of <func> may be passed in
+
+    :returns: (key, dependency, position) for each dependency where position is
+              the index the argument takes when passed positionally, or
+              :py:data:`sys.maxsize` if it can only be passed by keyword
+    :rtype: tuple
+    """
+    positions = {}
+    for position, param in enumerate(_inspect.signature(func).parameters.values()):
+        if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+            positions[param.name] = position
+    return tuple((key, dep, positions.get(key, _sys.maxsize)) for key, dep in deps.items())
+
+def _wrap_call(func, deps, builder):
+    """Wrap <func> so that <deps> are built with <builder> and injected on each call
+
+    Dependencies the caller supplied (positionally or by keyword) are not built
+    """
+    deps = dict(deps)
+    plan = _plan(func, deps)
+
+    if _inspect.iscoroutinefunction(func):
+        build_async = getattr(builder, 'build_async', None)
+
+        @_wraps(func)
+        async def call(*args, **kwargs):
+            todo = deps
+            if args or kwargs:
+                n = len(args)
+                todo = {key: dep for key, dep, position in plan
+                        if position >= n and key not in kwargs}
+            if not todo:
+                return await func(*args, **kwargs)
+            if build_async:
+                new_kwargs = await build_async(func, todo)
+            else:
+                new_kwargs = builder(func, todo)
+            new_kwargs.update(kwargs)
+
+            return await func(*args, **new_kwargs)
+    else:
+        @_wraps(func)
+        def call(*args, **kwargs):
+            todo = deps
+            if args or kwargs:
+                n = len(args)
+                todo = {key: dep for key, dep, position in plan
+                        if position >= n and key not in kwargs}
+            if not todo:
+                return func(*args, **kwargs)
+            new_kwargs = builder(func, todo)
+            new_kwargs.update(kwargs)
+
+            return func(*args, **new_kwargs)
+
+    return call
+
+def inject(builder=None, /, **dep_kwargs):
+    """.. py:decorator:: inject([builder], **kwargs)
     
     Inject dependencies into an object
     
@@ -65,6 +312,8 @@ def inject(**dep_kwargs):
     the argument supplied in the function call and not the kwarg supplied in inject to 
     take precedence, allowing overriding of dependencies on a per call basis
     
+    :param builder: (optional, positional only) function used to construct the 
+                    dependencies eg :py:class:`Parallel` (Default: :py:func:`build_deps`)
     :param dict kwargs: A dictionary of dependencies to fill in in the wrapped function
                         the value of each key will be executed to build the dependency
                         and then placed into the wrapped functions kwargs with the same 
@@ -72,32 +321,17 @@ def inject(**dep_kwargs):
     :returns:  A wrapped function
     :rtype:    func
     """
+    if builder is None:
+        builder = build_deps
+
     def wrapped(obj):
         log.info("Found object for injection: %s, injecting: %s", obj, dep_kwargs)
-        def build_deps():
-            kwargs = {}
-            for key, dep in dep_kwargs.items():
-                try:
-                    dep = dep(obj, key)
-                    kwargs[key] = dep
-                except Exception as err:
-                    log.info('{} dependency (key="{}") raised an exception, '
-                             'using default value. exception: {}'.format(obj, key, err)) 
-            return kwargs
-            
         if _inspect.isfunction(obj):
             # Indirect injection (Builder)
-            @_wraps(obj)
-            def call(*args, **kwargs):
-                new_kwargs = build_deps()
-                new_kwargs.update(kwargs)
-                
-                return obj(*args, **new_kwargs)
-
-            return call
+            return _wrap_call(obj, dep_kwargs, builder)
         else:
             # Direct injection
-            attrs = build_deps()
+            attrs = builder(obj, dep_kwargs)
             for key, val in attrs.items():
                 setattr(obj, key, val)
             
@@ -105,10 +339,15 @@ def inject(**dep_kwargs):
 
     return wrapped
 
-def inject3(func):
+def inject3(func=None, *, builder=None):
     """Special python3 version of :py:function:`inject()` that uses function argument
     annotations to specifiy injections instead of specifying them in :py:function:`inject()`
     kwargs
+
+    May be used bare (``@inject3``) or with a builder (``@inject3(builder=Parallel())``)
+
+    Only callable annotations are treated as dependencies, the return annotation 
+    and annotations such as ``a:3`` are ignored
     
     Example:
     >>> @inject3
@@ -125,27 +364,389 @@ def inject3(func):
     ...     return (a, b)
     >>> test(3)
     (3, 4)
+
+    # dependencies supplied by the caller are never built
+    >>> built = []
+    >>> def counted(request, key):
+    ...     built.append(key)
+    ...     return key
+    >>> @inject3
+    ... def test(a:counted, b:counted):
+    ...     return (a, b)
+    >>> test(1, b=2), built
+    ((1, 2), [])
     """
-    log.info("Found object for injection: %s, injecting: %s", func, func.__annotations__)
-    @_wraps(func)
-    def call(*args, **kwargs):
-        new_kwargs = {}
-        
-        for key, dep in func.__annotations__.items():
-            try:
-                dep = dep(func, key)
-                new_kwargs[key] = dep
-            except Exception as err:
-                log.info('{} dependency (key="{}") raised an exception, '
-                         'using default value. exception: {}'.format(func, key, err)) 
-        new_kwargs.update(kwargs)
-        
-        return func(*args, **new_kwargs)
-    return call
+    if func is None:
+        return lambda func: inject3(func, builder=builder)
+    if builder is None:
+        builder = build_deps
+
+    deps = {}
+    for name, param in _inspect.signature(func).parameters.items():
+        if callable(param.annotation) and param.annotation is not param.empty:
+            deps[name] = param.annotation
+
+    log.info("Found object for injection: %s, injecting: %s", func, deps)
+    return _wrap_call(func, deps, builder)
+
+class Scope:
+    """Base class of dependency lifetimes
+
+    A scope wraps a dependency constructor and is itself a dependency constructor,
+    it decides when the wrapped constructor is called and when the object it built
+    is torn down. construction is lazy, nothing is built until the first time the
+    dependency is injected
+
+    :param constructor: The dependency constructor to wrap
+    :param teardown: (optional) function called with the object when the scope ends
+                     (Default: call the object's close() method if it has one)
+    """
+    def __init__(self, constructor, teardown=None):
+        self.constructor = constructor
+        self.teardown = teardown
+
+    def __call__(self, request, key):
+        raise NotImplementedError
+
+    def destroy(self, obj):
+        """Tear down an object built by this scope"""
+        try:
+            if self.teardown:
+                self.teardown(obj)
+            else:
+                close = getattr(obj, 'close', None)
+                if close:
+                    close()
+        except Exception as err:
+            log.warning('Teardown of %r from %r failed: %s', obj, self, err)
+
+    def close(self):
+        """Tear down all objects held by this scope"""
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.constructor)
+
+class Transient(Scope):
+    """Build a new object every time the dependency is injected, the same as not 
+    using a scope at all. provided so the lifetime can be stated explicitly
+    """
+    def __call__(self, request, key):
+        return self.constructor(request, key)
+
+_NOTSET = object()
+
+class Singleton(Scope):
+    """Build the object once and share it between every call and every thread
+
+    Only use this for objects that are safe to share between threads
+
+    >>> counter = []
+    >>> def build(request, key):
+    ...     counter.append(key)
+    ...     return len(counter)
+    >>> @inject(a=Singleton(build))
+    ... def test(a):
+    ...     return a
+    >>> test(), test()
+    (1, 1)
+    """
+    def __init__(self, constructor, teardown=None):
+        super().__init__(constructor, teardown)
+        self._lock = _Lock()
+        self._obj = _NOTSET
+
+    def __call__(self, request, key):
+        obj = self._obj
+        if obj is _NOTSET:
+            with self._lock:
+                obj = self._obj
+                if obj is _NOTSET:
+                    obj = self._obj = self.constructor(request, key)
+        return obj
+
+    def close(self):
+        with self._lock:
+            obj, self._obj = self._obj, _NOTSET
+        if obj is not _NOTSET:
+            self.destroy(obj)
+
+class PerThread(Scope):
+    """Build one object per thread and reuse it for every call on that thread
+
+    Objects are kept until :py:meth:`close` is called, even if their thread has exited
+    """
+    def __init__(self, constructor, teardown=None):
+        super().__init__(constructor, teardown)
+        self._lock = _Lock()
+        self._local = _local()
+        self._objs = []
+
+    def __call__(self, request, key):
+        try:
+            return self._local.obj
+        except AttributeError:
+            obj = self._local.obj = self.constructor(request, key)
+            with self._lock:
+                self._objs.append(obj)
+            return obj
+
+    def close(self):
+        with self._lock:
+            objs, self._objs = self._objs, []
+            self._local = _local()
+        for obj in reversed(objs):
+            self.destroy(obj)
+
+# objects built by PerRequest scopes for the current request, None if there is
+# no active request
+_request = _contextvars.ContextVar('dyno.injection.request', default=None)
+
+class PerRequest(Scope):
+    """Build the object at most once per :py:func:`request_scope` and tear it down 
+    when the request ends
+
+    Outside of a :py:func:`request_scope` the dependency fails (and so falls back to
+    its default value) as there is nothing to tie the object's lifetime to
+
+    >>> def build(request, key):
+    ...     return object()
+    >>> conn = PerRequest(build)
+    >>> @inject(a=conn, b=conn)
+    ... def test(a=None, b=None):
+    ...     return a is b
+    >>> with request_scope():
+    ...     test()
+    True
+    """
+    def __call__(self, request, key):
+        objs = _request.get()
+        if objs is None:
+            raise LookupError('No request scope is active')
+        try:
+            return objs[self][1]
+        except KeyError:
+            obj = self.constructor(request, key)
+            # another dependency (eg in a Parallel builder) may have beaten us to it
+            winner = objs.setdefault(self, (self, obj))[1]
+            if winner is not obj:
+                self.destroy(obj)
+            return winner
+
+@_contextmanager
+def request_scope():
+    """Delimit a request, objects built by :py:class:`PerRequest` scopes inside the
+    block are shared for its duration and torn down (newest first) when it exits
+    """
+    objs = {}
+    token = _request.set(objs)
+    try:
+        yield
+    finally:
+        _request.reset(token)
+        for scope, obj in reversed(list(objs.values())):
+            scope.destroy(obj)
+
+class Resolver:
+    """A TTL bounded cache of :py:func:`socket.getaddrinfo` results
+
+    Also remembers which addresses recently failed to connect so they can be 
+    tried last. if a lookup fails and an expired answer is still cached it is
+    used rather than failing the connection
+
+    :param float ttl: Seconds to cache a lookup for
+    :param int maxsize: Maximum amount of lookups (and failed addresses) to remember,
+                        the least recently used lookups are forgotten first
+    :param float penalty: Seconds an address is deprioritized for after it fails
+    :param clock: function returning the current time in seconds
+
+    >>> resolver = Resolver()
+    >>> addresses = resolver.getaddrinfo('127.0.0.1', 80, type=_socket.SOCK_STREAM)
+    >>> addresses is resolver.getaddrinfo('127.0.0.1', 80, type=_socket.SOCK_STREAM)
+    True
+    """
+    def __init__(self, ttl=30, maxsize=1024, penalty=30, clock=_monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.penalty = penalty
+        self.clock = clock
+        self._lock = _Lock()
+        self._cache = _OrderedDict()
+        self._failed = _OrderedDict()
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0):
+        """Same as :py:func:`socket.getaddrinfo` but cached"""
+        key = (host, port, family, type, proto)
+        now = self.clock()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > now:
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+            return entry[1]
+
+        try:
+            addresses = _socket.getaddrinfo(host, port, family, type, proto)
+        except OSError as err:
+            if entry is None:
+                raise
+            log.info('Lookup of %s failed (%s), using expired addresses', host, err)
+            return entry[1]
+
+        with self._lock:
+            self._cache[key] = now + self.ttl, addresses
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return addresses
+
+    def failed(self, addr):
+        """Record that connecting to <addr> failed"""
+        with self._lock:
+            self._failed[addr] = self.clock()
+            self._failed.move_to_end(addr)
+            if len(self._failed) > self.maxsize:
+                self._failed.popitem(last=False)
+
+    def succeeded(self, addr):
+        """Record that connecting to <addr> worked"""
+        if addr in self._failed:
+            with self._lock:
+                self._failed.pop(addr, None)
+
+    def sort(self, addresses):
+        """Order <addresses> for connection attempts
+
+        address families are interleaved (RFC 8305 section 4) keeping the resolver's
+        preferred family first, then addresses that failed recently are moved to 
+        the end
+
+        :param list addresses: :py:func:`socket.getaddrinfo` results
+        :rtype: list
+        """
+        families = _OrderedDict()
+        for address in addresses:
+            families.setdefault(address[0], []).append(address)
+        interleaved = []
+        groups = list(families.values())
+        while groups:
+            for group in groups:
+                interleaved.append(group.pop(0))
+            groups = [group for group in groups if group]
+
+        if not self._failed:
+            return interleaved
+        recent = self.clock() - self.penalty
+        failed = self._failed
+        # sort is stable so the order within healthy and failed is kept
+        return sorted(interleaved, key=lambda address: failed.get(address[4], recent) > recent)
+
+    def clear(self):
+        """Forget all cached lookups and failures"""
+        with self._lock:
+            self._cache.clear()
+            self._failed.clear()
+
+# Shared between all socket dependencies that don't supply their own
+default_resolver = Resolver()
+
+def happy_eyeballs(addresses, timeout, delay=CONNECT_DELAY, resolver=default_resolver):
+    """Connect to the first of <addresses> to accept a connection
+
+    Attempts are started <delay> seconds apart (or straight away when the previous 
+    attempt fails) and raced against each other, the first to connect wins and the
+    rest are abandoned
+
+    :param list addresses: :py:func:`socket.getaddrinfo` results in the order to try them
+    :param float timeout: Seconds to wait overall before giving up
+    :param float delay: Seconds between starting connection attempts
+    :param Resolver resolver: Informed of the addresses that fail or succeed
+    :returns: A connected socket with its timeout set to <timeout>
+    :rtype: socket.socket
+    """
+    pending = list(addresses)
+    attempts = {}
+    error = None
+    start = _monotonic()
+    deadline = start + timeout
+    next_attempt = start
+    selector = _selectors.DefaultSelector()
+    try:
+        while pending or attempts:
+            now = _monotonic()
+            if now >= deadline:
+                break
+
+            if pending and (now >= next_attempt or not attempts):
+                family, type, proto, name, addr = pending.pop(0)
+                try:
+                    s = _socket.socket(family, type, proto)
+                except OSError as err:
+                    # eg the address family isn't supported on this host
+                    resolver.failed(addr)
+                    error = err
+                    continue
+                s.setblocking(False)
+                err = s.connect_ex(addr)
+                if err == 0:
+                    resolver.succeeded(addr)
+                    s.settimeout(timeout)
+                    return s
+                if err in (_errno.EINPROGRESS, _errno.EWOULDBLOCK, _errno.EAGAIN):
+                    attempts[s] = addr
+                    selector.register(s, _selectors.EVENT_WRITE)
+                    next_attempt = now + delay
+                else:
+                    s.close()
+                    resolver.failed(addr)
+                    error = OSError(err, _os.strerror(err))
+                continue
+
+            wake = min(deadline, next_attempt) if pending else deadline
+            for key, events in selector.select(max(0, wake - now)):
+                s = key.fileobj
+                addr = attempts.pop(s)
+                selector.unregister(s)
+                err = s.getsockopt(_socket.SOL_SOCKET, _socket.SO_ERROR)
+                if err == 0:
+                    resolver.succeeded(addr)
+                    s.settimeout(timeout)
+                    return s
+                s.close()
+                resolver.failed(addr)
+                error = OSError(err, _os.strerror(err))
+                # don't wait out the delay, the last attempt is dead
+                next_attempt = now
+
+        for addr in attempts.values():
+            resolver.failed(addr)
+        raise error if error else _socket.timeout('timed out')
+    finally:
+        for s in attempts:
+            s.close()
+        selector.close()
+
+def _connect(domain, port, family, type, proto, timeout, retries, resolver=None, delay=None):
+    """Connect to the fastest address of <domain> that accepts the connection"""
+    if resolver is None:
+        resolver = default_resolver
+    if delay is None:
+        delay = min(CONNECT_DELAY, timeout / 2)
+
+    def attempt():
+        addresses = resolver.getaddrinfo(domain, port, family, type, proto)
+        if not addresses:
+            raise IOError('No addresses for {}:{}'.format(domain, port))
+        return happy_eyeballs(resolver.sort(addresses), timeout, delay, resolver)
+
+    try:
+        return _retry(retries)(attempt)
+    except _CompoundException as err:
+        log.debug('Recived compound exception while connecting to %s:%s (%s)', domain, port, err)
+        raise IOError('Could not connect to {}:{}'.format(domain, port)) from err
 
 def socket(domain, port, # address settings
            family=_socket.AF_UNSPEC, type=_socket.SOCK_STREAM, proto=_socket.IPPROTO_IP, # connection type
-           timeout=LAN_TIMEOUT, retries=1): # connection policy
+           timeout=LAN_TIMEOUT, retries=1, resolver=None, delay=None): # connection policy
     """socket: a factory for socket connections to a remote server and an example of a dependency to be injected
     
     :param str domain: The domain or ip to connect to
@@ -162,25 +763,262 @@ def socket(domain, port, # address settings
                         multiple records exisst for the domain the server will try them each 
                         in turn before retyring the same connection in an attempt to avoid 
                         using an overloaded server
+    :param Resolver resolver: (optional) DNS cache to use (Default: :py:data:`default_resolver`)
+    :param float delay: (optional) seconds between starting connection attempts to each
+                        address (Default: :py:const:`CONNECT_DELAY` or timeout/2)
     :returns: Factory function for buildign a socket connection
     :rtype: function
     """
     def constructor(request, key):
-        addresses = _socket.getaddrinfo(domain, port, family, type, proto)
-        try:
-            @_retry(retries)
-            def block():
-                for *args, name, addr in addresses:
-                    try:
-                        s = _socket.socket(*args)
-                        s.settimeout(timeout)
-                        s.connect(addr)
-                        
-                        return s
-                    except _socket.error as err:
-                        continue
-        except _CompuoundException as err:
-            log.debug('Recived compound exception while connecting to %s:%d (%s)',domain, port, err)
-            raise IOError('Could not connect to %s:%d', domain, port)
+        return _connect(domain, port, family, type, proto, timeout, retries, resolver, delay)
     return constructor
 
+class PoolExhausted(IOError):
+    """All connections in the pool are in use"""
+
+class PooledSocket:
+    """A connection checked out of a :py:class:`SocketPool`, behaves like the socket
+    it wraps except that :py:meth:`close` returns it to the pool
+    """
+    def __init__(self, pool, sock):
+        self._pool = pool
+        self._sock = sock
+
+    def __getattr__(self, key):
+        if self._sock is None:
+            raise OSError('Connection has been returned to the pool')
+        return getattr(self._sock, key)
+
+    def close(self):
+        """Return the connection to the pool"""
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            self._pool.checkin(sock)
+
+    def discard(self):
+        """Close the connection for real, use this if the connection is in an
+        unknown state (eg after an error part way through a request)
+        """
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            self._pool.discard(sock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self._sock)
+
+class SocketPool:
+    """A pool of connections to a single endpoint
+
+    Returned connections are kept idle for reuse, checked for being closed by
+    the remote end before being handed out again and closed if they sit idle for 
+    longer than <idle_timeout>
+
+    :param str domain: The domain or ip to connect to
+    :param int port: The port number or service name to connect to
+    :param int maxsize: Maximum amount of connections (idle and in use) at once
+    :param float idle_timeout: Close connections that have been idle this many seconds
+    :param float wait: Seconds to wait for a connection to be returned when the pool
+                       is full before raising :py:exc:`PoolExhausted`
+    :param Metrics metrics: (optional) :py:class:`dyno.metrics.Metrics` to report pool 
+                            gauges and counters to
+    
+    See :py:func:`socket` for the remaining arguments
+
+    >>> server = _socket.create_server(('127.0.0.1', 0))
+    >>> pool = SocketPool('127.0.0.1', server.getsockname()[1], maxsize=1)
+    >>> conn = pool.checkout()
+    >>> pool.checkout() #doctest: +ELLIPSIS
+    Traceback (most recent call last):
+      ...
+    dyno.injection.PoolExhausted: Pool for 127.0.0.1:... is full
+    >>> conn.close()
+    >>> pool.idle, pool.size
+    (1, 1)
+    >>> with pool.checkout() as conn:
+    ...     pool.idle
+    0
+    >>> pool.close()
+    >>> server.close()
+    """
+    def __init__(self, domain, port,
+                 family=_socket.AF_UNSPEC, type=_socket.SOCK_STREAM, proto=_socket.IPPROTO_IP,
+                 timeout=LAN_TIMEOUT, retries=1, resolver=None, delay=None,
+                 maxsize=8, idle_timeout=60, wait=0, metrics=None):
+        self.domain = domain
+        self.port = port
+        self._connect_args = (domain, port, family, type, proto, timeout, retries, resolver, delay)
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.wait = wait
+        self.metrics = metrics
+        self._prefix = 'pool.{}:{}.'.format(domain, port)
+
+        self._cond = _Condition(_Lock())
+        # (socket, time returned) pairs, most recently returned on the right
+        self._idle = _deque()
+        self.size = 0
+        self.closed = False
+
+    @property
+    def idle(self):
+        """The amount of idle connections"""
+        return len(self._idle)
+
+    def _report(self, counter=None):
+        metrics = self.metrics
+        if metrics is None:
+            return
+        if counter:
+            metrics.incr(self._prefix + counter)
+        metrics.gauge(self._prefix + 'idle', len(self._idle))
+        metrics.gauge(self._prefix + 'in_use', self.size - len(self._idle))
+
+    def _healthy(self, sock):
+        """Check the remote end has not closed the connection while it was idle"""
+        try:
+            sock.setblocking(False)
+            # an idle connection should have nothing to read, b'' means the
+            # remote end hung up and unexpected data means we are out of sync
+            sock.recv(1, _socket.MSG_PEEK)
+        except BlockingIOError:
+            sock.settimeout(self.timeout)
+            return True
+        except OSError:
+            pass
+        return False
+
+    def _evict(self, now):
+        idle = self._idle
+        oldest = now - self.idle_timeout
+        while idle and idle[0][1] < oldest:
+            sock, returned = idle.popleft()
+            self.size -= 1
+            sock.close()
+            self._report('evicted')
+
+    def checkout(self, wait=None):
+        """Take a connection from the pool, connecting if there are no idle
+        connections and the pool is not full
+
+        :param float wait: (optional) override the pool's <wait>
+        :returns: A connection, call close() on it to return it to the pool
+        :rtype: PooledSocket
+        """
+        wait = self.wait if wait is None else wait
+        deadline = _monotonic() + wait
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise IOError('Pool for {}:{} is closed'.format(self.domain, self.port))
+                now = _monotonic()
+                self._evict(now)
+                while self._idle:
+                    sock, returned = self._idle.pop()
+                    if self._healthy(sock):
+                        self._report('reused')
+                        return PooledSocket(self, sock)
+                    self.size -= 1
+                    sock.close()
+                    self._report('unhealthy')
+
+                if self.size < self.maxsize:
+                    # reserve our slot then connect without holding the lock
+                    self.size += 1
+                    break
+                if now >= deadline or not self._cond.wait(deadline - now):
+                    self._report('exhausted')
+                    raise PoolExhausted('Pool for {}:{} is full'.format(self.domain, self.port))
+
+        try:
+            sock = _connect(*self._connect_args)
+        except Exception:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._report('connected')
+        return PooledSocket(self, sock)
+
+    def checkin(self, sock):
+        """Return a connection to the pool"""
+        with self._cond:
+            if self.closed:
+                self.size -= 1
+                sock.close()
+            else:
+                self._idle.append((sock, _monotonic()))
+            self._report()
+            self._cond.notify()
+
+    def discard(self, sock):
+        """Close a checked out connection instead of returning it"""
+        with self._cond:
+            self.size -= 1
+            sock.close()
+            self._report('discarded')
+            self._cond.notify()
+
+    def close(self):
+        """Close all idle connections, connections in use are closed when returned"""
+        with self._cond:
+            self.closed = True
+            while self._idle:
+                sock, returned = self._idle.pop()
+                self.size -= 1
+                sock.close()
+            self._report()
+            self._cond.notify_all()
+
+    def __repr__(self):
+        return '<{}: {}:{} {}/{} idle>'.format(self.__class__.__name__, self.domain,
+                                               self.port, len(self._idle), self.size)
+
+# shared pools, one per endpoint
+_pools = {}
+_pools_lock = _Lock()
+
+def pooled_socket(domain, port, # address settings
+                  family=_socket.AF_UNSPEC, type=_socket.SOCK_STREAM, proto=_socket.IPPROTO_IP, # connection type
+                  timeout=LAN_TIMEOUT, retries=1, resolver=None, delay=None, # connection policy
+                  maxsize=8, idle_timeout=60, wait=0, metrics=None): # pool policy
+    """pooled_socket: a factory for connections taken from a :py:class:`SocketPool`
+
+    All dependencies for the same endpoint share a single pool. the pool settings
+    of the first dependency created for an endpoint are used. the connection is 
+    returned to the pool when it is closed, wrap the dependency in a 
+    :py:class:`PerRequest` scope to have this happen automatically when the 
+    request ends:
+
+        @inject(db=PerRequest(pooled_socket('db.local', 5432)))
+        def handler(db=None):
+            ...
+
+    See :py:class:`SocketPool` and :py:func:`socket` for the arguments
+    
+    :returns: Factory function for checking out a connection
+    :rtype: function
+    """
+    endpoint = (domain, port, family, type, proto)
+    with _pools_lock:
+        pool = _pools.get(endpoint)
+        if pool is None or pool.closed:
+            pool = _pools[endpoint] = SocketPool(domain, port, family, type, proto,
+                                                 timeout, retries, resolver, delay,
+                                                 maxsize, idle_timeout,
+                                                 wait, metrics)
+
+    def constructor(request, key):
+        return pool.checkout()
+    constructor.pool = pool
+    return constructor
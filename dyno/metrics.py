@@ -1,34 +1,147 @@
 #!/usr/bin/env python3
 """Metrics: Collect and report statistics over a short period of time"""
-from time import time as now
-from bisect import bisect_right as _bisect
+from time import time as now, monotonic as _monotonic
+from collections import deque as _deque
+from threading import Lock as _Lock
 
 MINUTES = 60
 HOURS = 60 * MINUTES
 
+class RollingWindow:
+    """Count events in a ring of buckets covering the last <span> seconds
+
+    Old buckets are recycled as time moves forward so recording an event and
+    reading the totals are both constant time and the memory used is fixed
+
+    :param float span: The amount of time in seconds the window covers
+    :param int buckets: The amount of buckets the window is split into, events
+                        expire one bucket at a time
+    :param clock: function returning the current time in seconds
+    :param events: (optional) names of the events to count (Default: :py:attr:`EVENTS`)
+
+    >>> t = [0.0]
+    >>> window = RollingWindow(span=10, buckets=10, clock=lambda: t[0])
+    >>> window.add('success')
+    >>> window.add('failure', 2)
+    >>> window.total('failure')
+    2
+    >>> t[0] = 10.5
+    >>> window.total('failure')
+    0
+    """
+    EVENTS = ('success', 'failure', 'timeout', 'short_circuit', 'rejected')
+
+    def __init__(self, span=10, buckets=10, clock=_monotonic, events=None):
+        self.span = span
+        self.buckets = buckets
+        self.clock = clock
+        if events is not None:
+            self.EVENTS = tuple(events)
+        self._width = span / buckets
+        self._lock = _Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded events"""
+        self._epochs = [None] * self.buckets
+        self._counts = {event: [0] * self.buckets for event in self.EVENTS}
+
+    def add(self, event, n=1, now=None):
+        """Record <n> occurrences of <event>
+
+        :param str event: One of :py:attr:`EVENTS`
+        :param int n: Amount of events to record
+        :param float now: (optional) the current time if already known
+        """
+        if now is None:
+            now = self.clock()
+        epoch = int(now / self._width)
+        i = epoch % self.buckets
+        with self._lock:
+            if self._epochs[i] != epoch:
+                # bucket has rolled over, clear the old values
+                self._epochs[i] = epoch
+                for counts in self._counts.values():
+                    counts[i] = 0
+            self._counts[event][i] += n
+
+    def _live(self, now):
+        if now is None:
+            now = self.clock()
+        oldest = int(now / self._width) - self.buckets
+        return [i for i, epoch in enumerate(self._epochs)
+                if epoch is not None and epoch > oldest]
+
+    def total(self, event, now=None):
+        """:returns: The amount of <event> recorded in the window
+        :rtype: int
+        """
+        counts = self._counts[event]
+        return sum(counts[i] for i in self._live(now))
+
+    def totals(self, now=None):
+        """:returns: A mapping of every event to the amount recorded in the window
+        :rtype: dict
+        """
+        live = self._live(now)
+        return {event: sum(counts[i] for i in live)
+                for event, counts in self._counts.items()}
+
 class Metrics:
-    def __init__(self, traffic_span=2*MINUTES, latency_span=1*MINUTES, counters_span=10):
+    def __init__(self, traffic_span=2*MINUTES, latency_span=1*MINUTES, counters_span=10,
+                 clock=_monotonic):
         """ 
         :param float span: collect statistics for the last N seconds
+        :param clock: function returning the current time in seconds, used by 
+                      :py:attr:`window`
         """
         self.traffic_span = traffic_span
         self.latency_span = latency_span
         self.counters_span = counters_span
+
+        # outcome counters, pass this to AutoBreaker(window=...) so the breaker
+        # trips on the same numbers that are reported
+        self.window = RollingWindow(span=counters_span, clock=clock)
         
-        self.succeeded = []
-        self.failed = []
+        self.succeeded = _deque()
+        self.failed = _deque()
+
+        self.gauges = {}
+        self.counters = {}
+
+    def gauge(self, name, value):
+        """Record the current value of something that goes up and down, eg the
+        amount of idle connections in a pool
+
+        :param str name: The name of the gauge
+        :param value: The current value
+        """
+        self.gauges[name] = value
+
+    def incr(self, name, n=1):
+        """Increment a named counter
+
+        :param str name: The name of the counter
+        :param int n: The amount to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
         
-    def success(self):
+    def _record(self, times):
         n = now()
-        self.succeeded.append(n)
-        i = _bisect(self.succeeded, n - self.counters_span)
-        self.succeeded = self.succeeded[i:]
+        times.append(n)
+        # timestamps are appended in order so the expired ones are at the front,
+        # dropping them one at a time avoids copying the whole list on every call
+        cutoff = n - self.counters_span
+        while times[0] <= cutoff:
+            times.popleft()
+
+    def success(self):
+        self._record(self.succeeded)
+        self.window.add('success')
         
     def failure(self):
-        n = now()
-        self.failed.append(n)
-        i = _bisect(self.failed, n - self.counters_span)
-        self.failed = self.failed[i:]
+        self._record(self.failed)
+        self.window.add('failure')
 
     @property
     def graph(self):
@@ -53,23 +166,23 @@ class Metrics:
 
     @property
     def successes(self):
-        pass
+        return self.window.total('success')
         
     @property
     def short_circuits(self):
-        pass
+        return self.window.total('short_circuit')
         
     @property
     def thread_timeouts(self):
-        pass
+        return self.window.total('timeout')
         
     @property
     def pool_rejections(self):
-        pass
+        return self.window.total('rejected')
         
     @property
     def failures(self):
-        pass
+        return self.window.total('failure')
         
 
     def __enter__(self):
@@ -18,17 +18,169 @@ dyno.registry.NotRegistered: The key: "my_obj" has not yet been registered
 >>> reg['my_obj'] = True
 >>> test_func()
 True
+
+Proxies remember the object they resolved to and only look it up again after the
+registry has been changed. code that wants the concrete object itself (eg in an
+inner loop) can ask for it with :py:meth:`Registry.bind` once it is registered
+
+>>> reg.bind('my_obj')
+True
+
+Reconfiguration
+'''''''''''''''
+The registry is copy on write, every change publishes a new dict so readers never
+need a lock and never see a half applied change. several keys can be changed in
+one step with :py:meth:`Registry.update_atomic`. code that needs to react to
+changes can :py:meth:`Registry.subscribe` a callback or iterate over a
+:py:meth:`Registry.watch` and :py:class:`FileLoader` keeps the registry in sync
+with a config file
+
+>>> changes = []
+>>> unsubscribe = reg.subscribe(lambda key, old, new: changes.append((key, new)), prefix='db.')
+>>> reg.update_atomic({'db.host': 'localhost', 'db.port': 5432, 'other': 1})
+>>> sorted(changes)
+[('db.host', 'localhost'), ('db.port', 5432)]
+>>> unsubscribe()
 """
 
 from collections import UserDict as _UserDict
+from collections.abc import Mapping as _Mapping
+from threading import Lock as _Lock, Thread as _Thread, Event as _Event
+from types import MappingProxyType as _MappingProxyType
+import json as _json
 import logging as _logging
+import os as _os
+import queue as _queue
 
 log = _logging.getLogger('dyno.registry')
 
+# marker for missing keys, never stored in a registry. passed to subscribers as
+# the old value of a new key or the new value of a deleted key
+MISSING = _NOTSET = object()
+
 class Registry(_UserDict):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, other=(), /, **kwargs):
+        # bumped on every change so proxies know when to look up their object again
+        self._version = 0
+        # serializes writers, readers never take it
+        self._lock = _Lock()
+        self._subscribers = []
+        self.data = {}
         self.get = self.data.get
+        if other or kwargs:
+            self.update(other, **kwargs)
+
+    def __setitem__(self, key, val):
+        self.update_atomic({key: val})
+
+    def update(self, other=(), /, **kwargs):
+        """Set several keys in one step, see :py:meth:`update_atomic`
+
+        UserDict would set them one at a time, copying the registry and
+        notifying subscribers for every key
+        """
+        self.update_atomic(_chain_items(other, kwargs))
+
+    def __delitem__(self, key):
+        self.update_atomic(deletions=[key])
+
+    def update_atomic(self, changes=(), deletions=(), missing_ok=False, **kwargs):
+        """Apply several changes to the registry in one step
+
+        Readers either see the registry as it was before or after all of the
+        changes, never part way through
+
+        :param changes: mapping or iterable of (key, value) pairs to set
+        :param deletions: keys to remove
+        :param bool missing_ok: skip keys in <deletions> that are not registered
+                                instead of raising KeyError
+        :param kwargs: more keys to set
+        :raises KeyError: if a key in <deletions> is not registered, in which case
+                          none of the changes are applied
+        """
+        events = []
+        with self._lock:
+            old = self.data
+            data = dict(old)
+            for key, val in _chain_items(changes, kwargs):
+                events.append((key, data.get(key, MISSING), val))
+                data[key] = val
+            for key in deletions:
+                if missing_ok and key not in data:
+                    continue
+                events.append((key, data.pop(key), MISSING))
+
+            self._publish(data)
+
+        self._notify(events)
+
+    def _publish(self, data):
+        """Make <data> the current contents of the registry, called with the lock held"""
+        self.data = data
+        self.get = data.get
+        self._version += 1
+
+    def overlay(self, *args, **kwargs):
+        """Create an :py:class:`Overlay` on top of this registry, see 
+        :py:class:`Overlay` for the arguments
+        """
+        return Overlay(self, *args, **kwargs)
+
+    def snapshot(self):
+        """:returns: a read only view of the registry at this moment that will not
+                     change when the registry does
+        :rtype: types.MappingProxyType
+        """
+        return _MappingProxyType(self.data)
+
+    def subscribe(self, callback, key=None, prefix=None):
+        """Call <callback>(key, old, new) after a matching key is changed
+
+        <old> is :py:data:`MISSING` for a newly added key and <new> is 
+        :py:data:`MISSING` for a deleted key. callbacks are run in the thread 
+        making the change, after the change is visible to readers
+
+        :param callback: function to call
+        :param key: (optional) only report changes to this key
+        :param str prefix: (optional) only report changes to keys starting with this
+        :returns: a function that cancels the subscription when called
+        :rtype: function
+        """
+        subscription = (callback, key, prefix)
+        with self._lock:
+            # copy on write, _notify iterates without the lock
+            self._subscribers = self._subscribers + [subscription]
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers = [sub for sub in self._subscribers if sub is not subscription]
+        return unsubscribe
+
+    def watch(self, key=None, prefix=None, maxsize=0):
+        """Iterate over changes to matching keys as they happen
+
+        :param key: (optional) only report changes to this key
+        :param str prefix: (optional) only report changes to keys starting with this
+        :param int maxsize: (optional) maximum amount of unread changes to buffer, 
+                            further changes are dropped (Default: unbounded)
+        :rtype: Watch
+        """
+        return Watch(self, key, prefix, maxsize)
+
+    def _notify(self, events):
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        for key, old, new in events:
+            for callback, match_key, prefix in subscribers:
+                if match_key is not None and key != match_key:
+                    continue
+                if prefix is not None and not (isinstance(key, str) and key.startswith(prefix)):
+                    continue
+                try:
+                    callback(key, old, new)
+                except Exception:
+                    log.exception('Subscriber %s failed handling change to %s', callback, key)
         
     def __dir__(self):
         keys = self.__dict__.keys()
@@ -40,23 +192,283 @@ class Registry(_UserDict):
         """same as get but explodes with an exception if key is not found
         like original obj[key] syntax
         """
-        class NoKey(object):
-            """Dummy hidden class so we don't trip up on returned default value
-            when object has been set but is the same as the default value as this
-            object is only guaranteed to exist in the current block/scope
-            """
-            pass
-
-        obj = self.get(key, NoKey)
-        if obj is NoKey:
+        obj = self.get(key, _NOTSET)
+        if obj is _NOTSET:
             raise KeyError(key)
             
         return obj
 
+    def bind(self, key):
+        """Get the concrete object registered at <key> rather than a proxy to it
+
+        Unlike a :py:class:`RegistryProxy` the returned object will not follow
+        later changes to the registry
+
+        :raises NotRegistered: if nothing is registered at <key> yet
+        """
+        obj = self.get(key, _NOTSET)
+        if obj is _NOTSET:
+            raise NotRegistered(key)
+
+        return obj
+
     def __missing__(self, key):
         log.debug('Could not find key: %s in self: %s, returning proxy', key, self)
         return RegistryProxy(self, key)
 
+class Overlay(Registry):
+    """A registry that only stores its own overrides and falls back to <base>
+    for everything else
+
+    Meant for vhosting where thousands of tenants share most of their 
+    configuration, memory used is proportional to the amount of overrides. 
+    overlays may be stacked. values found in the base are kept in a small 
+    flattened cache so hot keys are found in a single lookup, the cache is
+    dropped whenever the overlay or any registry below it changes
+
+    Subscribers to an overlay are only told about changes to the overlay itself,
+    subscribe to the base as well to hear about changes to shared keys
+
+    :param Registry base: The registry to fall back to
+    :param int cache_size: Maximum amount of values from the base to cache
+
+    >>> base = Registry({'db': 'shared-db', 'theme': 'plain'})
+    >>> tenant = base.overlay({'theme': 'fancy'})
+    >>> tenant['db'], tenant['theme'], base['theme']
+    ('shared-db', 'fancy', 'plain')
+    >>> tenant.data
+    {'theme': 'fancy'}
+    >>> base['db'] = 'new-db'
+    >>> tenant['db']
+    'new-db'
+    """
+    def __init__(self, base, *args, cache_size=256, **kwargs):
+        self.base = base
+        self.cache_size = cache_size
+        self._own_version = 0
+        self._cache = {}
+        self._cache_version = None
+        super().__init__(*args, **kwargs)
+        self.get = self._get
+
+    @property
+    def _version(self):
+        # every registry's version only ever goes up so the sum changes
+        # whenever any registry in the chain changes
+        return self._own_version + self.base._version
+
+    @_version.setter
+    def _version(self, value):
+        self._own_version = value
+
+    def _publish(self, data):
+        self.data = data
+        self._own_version += 1
+
+    def _get(self, key, default=None):
+        val = self.data.get(key, MISSING)
+        if val is not MISSING:
+            return val
+
+        version = self._version
+        if version != self._cache_version:
+            self._cache = {}
+            self._cache_version = version
+        cache = self._cache
+        val = cache.get(key, MISSING)
+        if val is MISSING:
+            val = self.base.get(key, MISSING)
+            if val is MISSING:
+                return default
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            cache[key] = val
+
+        return val
+
+    def __getitem__(self, key):
+        val = self.get(key, MISSING)
+        if val is MISSING:
+            return self.__missing__(key)
+        return val
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __iter__(self):
+        data = self.data
+        yield from data
+        for key in self.base:
+            if key not in data:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def snapshot(self):
+        return _MappingProxyType({**self.base.snapshot(), **self.data})
+
+    def __repr__(self):
+        return '<{}: {} over {!r}>'.format(self.__class__.__name__, self.data, self.base)
+
+def _chain_items(changes, kwargs):
+    if hasattr(changes, 'items'):
+        changes = changes.items()
+    yield from changes
+    yield from kwargs.items()
+
+class Watch:
+    """Iterator over the changes made to a :py:class:`Registry`, see 
+    :py:meth:`Registry.watch`
+
+    Each item is a (key, old, new) tuple. iteration blocks until the next change,
+    use :py:meth:`get` with a timeout to poll instead. :py:meth:`close` (or 
+    leaving a with block) stops the watch and ends any iteration in progress
+    """
+    _CLOSED = object()
+
+    def __init__(self, registry, key=None, prefix=None, maxsize=0):
+        self._queue = _queue.Queue(maxsize)
+        self._unsubscribe = registry.subscribe(self._put, key, prefix)
+
+    def _put(self, key, old, new):
+        try:
+            self._queue.put_nowait((key, old, new))
+        except _queue.Full:
+            log.warning('%r is full, dropping change to %s', self, key)
+
+    def get(self, timeout=None):
+        """Wait for the next change
+
+        :param float timeout: (optional) seconds to wait
+        :returns: (key, old, new)
+        :raises queue.Empty: if <timeout> passes without a change
+        :raises StopIteration: if the watch has been closed
+        """
+        item = self._queue.get(timeout=timeout)
+        if item is self._CLOSED:
+            self._queue.put(item)
+            raise StopIteration
+        return item
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    def close(self):
+        self._unsubscribe()
+        self._queue.put(self._CLOSED)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *tb):
+        self.close()
+
+class FileLoader:
+    """Keep keys in a :py:class:`Registry` in sync with a config file
+
+    The file is polled for changes in a background thread and reloaded into the
+    registry with :py:meth:`Registry.update_atomic`. only keys whose value
+    changed are updated and keys removed from the file are removed from the 
+    registry. if the file cannot be read or parsed, or does not hold a mapping, the
+    registry is left as it was
+
+    :param Registry registry: The registry to load into
+    :param str path: The file to load
+    :param parser: function taking an open file and returning a dict (Default: json.load)
+    :param float interval: Seconds between checks for changes
+    :param str prefix: Prepended to every key from the file
+
+    >>> import json, tempfile
+    >>> config = tempfile.NamedTemporaryFile('w', suffix='.json')
+    >>> def write(data):
+    ...     with open(config.name, 'w') as f:
+    ...         json.dump(data, f)
+    >>> write({'host': 'localhost', 'port': 5432})
+    >>> reg = Registry()
+    >>> loader = FileLoader(reg, config.name, prefix='db.')
+    >>> loader.reload()
+    True
+    >>> del reg['db.port'] # removed by someone else
+    >>> write({'host': 'db1'})
+    >>> loader.reload(), dict(reg.data)
+    (True, {'db.host': 'db1'})
+    >>> write(['not', 'a', 'mapping'])
+    >>> loader.reload(), dict(reg.data)
+    (False, {'db.host': 'db1'})
+    >>> config.close()
+    """
+    def __init__(self, registry, path, parser=_json.load, interval=1.0, prefix=''):
+        self.registry = registry
+        self.path = path
+        self.parser = parser
+        self.interval = interval
+        self.prefix = prefix
+        self._loaded = {}
+        self._stamp = None
+        self._stop = _Event()
+        self._thread = None
+
+    def reload(self, force=False):
+        """Load the file if it has changed since it was last loaded
+
+        :param bool force: load even if the file appears unchanged
+        :returns: True if the registry was updated
+        :rtype: bool
+        """
+        try:
+            stat = _os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if stamp == self._stamp and not force:
+                return False
+            with open(self.path) as f:
+                config = self.parser(f)
+            if not isinstance(config, _Mapping):
+                raise TypeError('expected a mapping, got {}'.format(type(config).__name__))
+        except Exception:
+            log.exception('Could not load %s, keeping the current configuration', self.path)
+            return False
+
+        config = {self.prefix + key: val for key, val in config.items()}
+        changes = {key: val for key, val in config.items()
+                   if key not in self._loaded or self._loaded[key] != val}
+        # keys may be removed by someone else before the update, they are skipped
+        deletions = [key for key in self._loaded if key not in config]
+        if changes or deletions:
+            log.info('Reloading %s: %d changed, %d removed', self.path, len(changes), len(deletions))
+            self.registry.update_atomic(changes, deletions, missing_ok=True)
+        self._stamp = stamp
+        self._loaded = config
+        return bool(changes or deletions)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reload()
+            except Exception:
+                log.exception('Reloading %s failed, will try again', self.path)
+
+    def start(self):
+        """Load the file and start watching it for changes
+
+        :returns: self
+        """
+        self.reload(force=True)
+        self._stop.clear()
+        self._thread = _Thread(target=self._run, name='dyno.registry.FileLoader', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching the file"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
 class NotRegistered(Exception):
     """The key: "{}" has not yet been registered"""
     def __str__(self):
@@ -104,6 +516,9 @@ class RegistryProxy:
     def __init__(self, registry, key):
         self.__dict__['_registry'] = registry
         self.__dict__['_key'] = key
+        # registry version the cached object was resolved at
+        self.__dict__['_version'] = None
+        self.__dict__['_obj'] = None
     
     # make object introspectable in standard python shells
     def __dir__(self):
@@ -115,10 +530,20 @@ class RegistryProxy:
         return attrs
     
     def _getobj(self):
+        registry = self._registry
+        if self._version == registry._version:
+            return self._obj
+
+        # read the version first so a change during the lookup is not missed
+        version = registry._version
         try:
-            return self._registry.simple_get(self._key)
+            obj = registry.simple_get(self._key)
         except KeyError as err:
             raise NotRegistered(self._key) from err
+        self.__dict__['_obj'] = obj
+        self.__dict__['_version'] = version
+
+        return obj
 
     ## Attribute proxy methods ##
     def __getattr__(self, key):
@@ -138,7 +563,7 @@ class RegistryProxy:
 
     ## Call proxy methods ##
     def __call__(self, *args, **kwargs):
-        self._getobj()(*args, **kwargs)
+        return self._getobj()(*args, **kwargs)
 
     def __repr__(self):
         return '<RegistryProxy: "{}" on {}>'.format(self._key, self._registry)
@@ -1,7 +1,44 @@
 #!/usr/bin/env python3
-"""Retry: Automatically handle re-execution of a code if the code raises an exception"""
+"""Retry: Automatically handle re-execution of a code if the code raises an exception
+
+:py:func:`retry`: Retry a function a set amount of times or according to a :py:class:`Policy`
+:py:class:`Policy`: How often, how fast and which errors to retry
+:py:func:`constant`, :py:func:`exponential`, :py:func:`decorrelated_jitter`: Backoff 
+                     functions for use with :py:class:`Policy`
+:py:class:`RetryBudget`: Cap the amount of retries to a percentage of all requests to a
+                         service so retries cannot snowball into a retry storm
+
+Coroutine functions are retried asynchronously, waiting between attempts with
+:py:func:`asyncio.sleep` and cancelling the attempt in progress when the
+:py:class:`Policy` deadline passes. cancelling the task stops any further attempts
+
+>>> import asyncio
+>>> async def slow():
+...     await asyncio.sleep(1)
+>>> try:
+...     asyncio.run(retry(Policy(3, deadline=0.05))(slow))
+... except TimeoutError as err:
+...     print(len(err), isinstance(err, CompoundException))
+1 True
+
+>>> calls = []
+>>> @retry(Policy(3, backoff=constant(0.01), retry_on=(IOError,)))
+... def flaky():
+...     calls.append(1)
+...     if len(calls) < 3:
+...         raise IOError('try again')
+...     return len(calls)
+>>> flaky
+3
+"""
+from dyno.metrics import RollingWindow as _RollingWindow
 from collections import OrderedDict as _OrderedDict
 from functools import wraps as _wraps
+from random import random as _random, uniform as _uniform
+from threading import Lock as _Lock
+from time import monotonic as _monotonic, sleep as _sleep
+import asyncio as _asyncio
+import inspect as _inspect
 import logging as _logging
 
 log = _logging.getLogger('dyno.retry')
@@ -56,32 +93,220 @@ def make_compound_exception(errors, *args, **kwargs):
     :returns: a Custom class that is a subclass of all provided exceptions and CompoundException
     :rtype: Subclass of all errors and Exception
     
-    Note: as the class is dynamically generated, 2 instances will not compare equal
+    The generated classes are memoized by their bases so errors of the same types 
+    share a class instead of building a new one on every failure
     eg:
-    >>> cls1 = make_compound_exception([ValueError()])
-    >>> cls2 = make_compound_exception([ValueError()])
-    >>> cls1 == cls2
-    False
-    
-    in practive this should not be an issue but if it is required let the author know as
-    it is not as simple as memoizing based on the args (which are instances of Exceptions
-    not Exception classes) and hence would have the same issue as indicated above
+    >>> exc1 = make_compound_exception([ValueError()])
+    >>> exc2 = make_compound_exception([ValueError()])
+    >>> type(exc1) is type(exc2)
+    True
+    >>> isinstance(exc1, ValueError)
+    True
+
+    Errors that are themselves compound (eg from nested retries) contribute the
+    classes they imitate rather than their own class
+    >>> nested = make_compound_exception([exc1, KeyError()])
+    >>> isinstance(nested, ValueError), isinstance(nested, KeyError)
+    (True, True)
     """
-    name = 'CompoundException'
-    bases = [CompoundException] + [e.__class__ for e in errors]
-    bases = uniq(bases)
-    bases = tuple(bases)
-    exc = type(name, bases, {})
+    bases = [CompoundException] + _flatten_bases(e.__class__ for e in errors)
+    bases = tuple(uniq(bases))
+    exc = _compound_class(bases)
 
     return exc(errors, *args, **kwargs)
+
+def _flatten_bases(classes):
+    # a class built by make_compound_exception can't be a base alongside
+    # CompoundException (the MRO would be inconsistent), use its bases instead
+    flat = []
+    for cls in classes:
+        if cls is not CompoundException and issubclass(cls, CompoundException):
+            flat.extend(_flatten_bases(cls.__bases__))
+        else:
+            flat.append(cls)
+    return flat
+
+# Classes built by make_compound_exception keyed by their bases, bounded so
+# unusual mixes of errors can't grow it forever
+COMPOUND_CACHE_SIZE = 128
+_compound_classes = _OrderedDict()
+_compound_lock = _Lock()
+
+def _compound_class(bases):
+    try:
+        cls = _compound_classes[bases]
+    except KeyError:
+        pass
+    else:
+        with _compound_lock:
+            if bases in _compound_classes:
+                _compound_classes.move_to_end(bases)
+        return cls
+
+    try:
+        cls = type('CompoundException', bases, {})
+    except TypeError:
+        # builtin exceptions with incompatible layouts (eg OSError and
+        # UnicodeError) can't be combined, imitate the most recent one only
+        log.debug('Could not combine %s, using %s', bases, bases[-1])
+        cls = type('CompoundException', (CompoundException, bases[-1]), {})
+
+    with _compound_lock:
+        cls = _compound_classes.setdefault(bases, cls)
+        if len(_compound_classes) > COMPOUND_CACHE_SIZE:
+            _compound_classes.popitem(last=False)
+
+    return cls
         
+def constant(delay):
+    """Wait the same amount of time between every attempt
+
+    :param float delay: seconds to wait
+    """
+    def backoff(attempt, last):
+        return delay
+    return backoff
+
+def exponential(base=0.1, factor=2, cap=10, jitter=True):
+    """Multiply the wait by <factor> after every attempt
+
+    :param float base: seconds to wait after the first attempt
+    :param float factor: multiplier applied on each attempt
+    :param float cap: maximum seconds to wait
+    :param bool jitter: if True (the default) wait a random time between 0 and
+                        the calculated delay ("full jitter") so clients that failed 
+                        together don't retry together
+    """
+    def backoff(attempt, last):
+        delay = min(cap, base * factor ** (attempt - 1))
+        return _random() * delay if jitter else delay
+    return backoff
+
+def decorrelated_jitter(base=0.1, cap=10):
+    """Wait a random time between <base> and 3 times the previous wait
+
+    :param float base: minimum seconds to wait
+    :param float cap: maximum seconds to wait
+    """
+    def backoff(attempt, last):
+        return min(cap, _uniform(base, max(base, last) * 3))
+    return backoff
+
+class RetryBudget:
+    """Limit retries to a fraction of the requests made to a service
+
+    Share one budget between every :py:class:`Policy` calling the same service.
+    a retry is only allowed while the retries in the last <span> seconds are 
+    fewer than <ratio> of the requests plus a small allowance of <min_per_second>
+    so that services with little traffic can still retry
+
+    :param float ratio: Allowed retries per request (eg 0.1 for 10%)
+    :param float min_per_second: Retries always allowed per second regardless of traffic
+    :param float span: Seconds of history to consider
+    :param clock: function returning the current time in seconds
+
+    >>> budget = RetryBudget(ratio=0.5, min_per_second=0)
+    >>> budget.request(); budget.request()
+    >>> budget.withdraw(), budget.withdraw()
+    (True, False)
+    """
+    def __init__(self, ratio=0.1, min_per_second=10, span=10, clock=_monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.span = span
+        self.window = _RollingWindow(span, clock=clock, events=('request', 'retry'))
+
+    def request(self):
+        """Record a request (first attempt)"""
+        self.window.add('request')
+
+    def withdraw(self):
+        """Ask for permission to retry
+
+        :returns: True if the retry may go ahead
+        :rtype: bool
+        """
+        totals = self.window.totals()
+        allowed = totals['request'] * self.ratio + self.min_per_second * self.span
+        if totals['retry'] >= allowed:
+            return False
+        self.window.add('retry')
+        return True
+
+class Policy:
+    """How to retry a function
+
+    :param int times: Maximum amount of attempts
+    :param backoff: (optional) function(attempt, last_delay) returning the seconds to
+                    wait before the next attempt eg :py:func:`exponential`. 
+                    (Default: retry immediately)
+    :param float deadline: (optional) seconds after the first attempt that no more
+                           attempts may be started, set this to the caller's timeout
+    :param RetryBudget budget: (optional) shared budget that may refuse a retry
+    :param retry_on: exception type(s) to retry, anything else is raised 
+                     immediately without retrying
+    :param giveup_on: exception type(s) never to retry even if they match <retry_on>
+    :param sleep: function used to wait between attempts
+    :param bool keep_tracebacks: if False (the default) only the last error keeps 
+                                 its traceback, the earlier ones are dropped so a burst
+                                 of failures doesn't keep all their frames alive
+    """
+    def __init__(self, times=3, backoff=None, deadline=None, budget=None,
+                 retry_on=Exception, giveup_on=(), sleep=_sleep, keep_tracebacks=False):
+        self.times = times
+        self.backoff = backoff
+        self.deadline = deadline
+        self.budget = budget
+        self.retry_on = retry_on
+        self.giveup_on = giveup_on
+        self.sleep = sleep
+        self.keep_tracebacks = keep_tracebacks
+
+    def retryable(self, err):
+        """:returns: True if <err> may be retried
+        :rtype: bool
+        """
+        return isinstance(err, self.retry_on) and not isinstance(err, self.giveup_on)
+
+    def next_delay(self, attempt, last, start, now=None):
+        """Work out how long to wait before the next attempt
+
+        :param int attempt: The attempt that just failed, starting at 1
+        :param float last: The previous delay
+        :param float start: When the first attempt started
+        :param float now: (optional) the current time from the same clock as <start>
+                          (Default: the monotonic clock)
+        :returns: seconds to wait, or None if no more attempts should be made
+        """
+        if attempt >= self.times:
+            return None
+        delay = self.backoff(attempt, last) if self.backoff else 0
+        if self.deadline is not None:
+            if now is None:
+                now = _monotonic()
+            if now + delay >= start + self.deadline:
+                log.debug('Not retrying, deadline of %ss would be exceeded', self.deadline)
+                return None
+        if self.budget is not None and not self.budget.withdraw():
+            log.debug('Not retrying, retry budget exhausted')
+            return None
+        return delay
+
+    def __repr__(self):
+        return '<{}: times={}, backoff={}, deadline={}>'.format(
+               self.__class__.__name__, self.times, self.backoff, self.deadline)
+
 def retry(times, *args, **kwargs):
     """ 
-    :param int times: the ammount of times to retry the function call
+    :param times: the ammount of times to retry the function call or a 
+                  :py:class:`Policy` for more control
+    :type times: int or Policy
     :param args: args to pass to the wrapped function
     :param kwargs: kwargs to pass to wrapped function
     :returns: value of func(*args, **kwargs)
     """
+    policy = times if isinstance(times, Policy) else Policy(times)
+    times = policy.times
     
     def wrapped(func, execute=True):
         """ 
@@ -92,23 +317,70 @@ def retry(times, *args, **kwargs):
                              function simmilar to a scope or anon function
         :returns: Return value of func(*args, **kwargs) or Wrapped function to call latter, 
                   you may use the earlier bound args and kwargs or specify them again when 
-                  calling the function
+                  calling the function. for coroutine functions the return value is a 
+                  coroutine to be awaited
         """
-        @_wraps(func)
-        def wrapper(*args, **kwargs):
-            errors = []
-            for i in range(times):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as err:
-                    log.debug('%s raised an exception (%s) on attempt %d/%d', func, err, i+1, times)
-                    errors.append(err)
-            
-            log.debug('%s failed %d times, aborting', func, times)
-            # All retry attempts failed, pass ALL exception
-            # upstream for handling
-            compound_err = make_compound_exception(errors)
-            raise compound_err from errors[-1]
+        def remember(errors, err, attempt):
+            log.debug('%s raised an exception (%s) on attempt %d/%d', func, err, attempt, times)
+            if errors and not policy.keep_tracebacks:
+                errors[-1].__traceback__ = None
+            errors.append(err)
+
+        if _inspect.iscoroutinefunction(func):
+            @_wraps(func)
+            async def wrapper(*args, **kwargs):
+                errors = []
+                start = _monotonic()
+                if policy.budget is not None:
+                    policy.budget.request()
+                delay = 0
+                for i in range(1, times + 1):
+                    try:
+                        if policy.deadline is None:
+                            return await func(*args, **kwargs)
+                        remaining = start + policy.deadline - _monotonic()
+                        return await _asyncio.wait_for(func(*args, **kwargs), remaining)
+                    except Exception as err:
+                        if not policy.retryable(err):
+                            raise
+                        remember(errors, err, i)
+
+                    delay = policy.next_delay(i, delay, start)
+                    if delay is None:
+                        break
+                    if delay:
+                        await _asyncio.sleep(delay)
+
+                log.debug('%s failed %d times, aborting', func, len(errors))
+                compound_err = make_compound_exception(errors)
+                raise compound_err from errors[-1]
+        else:
+            @_wraps(func)
+            def wrapper(*args, **kwargs):
+                errors = []
+                start = _monotonic()
+                if policy.budget is not None:
+                    policy.budget.request()
+                delay = 0
+                for i in range(1, times + 1):
+                    try:
+                        return func(*args, **kwargs)
+                    except Exception as err:
+                        if not policy.retryable(err):
+                            raise
+                        remember(errors, err, i)
+
+                    delay = policy.next_delay(i, delay, start)
+                    if delay is None:
+                        break
+                    if delay:
+                        policy.sleep(delay)
+
+                log.debug('%s failed %d times, aborting', func, len(errors))
+                # All retry attempts failed, pass ALL exception
+                # upstream for handling
+                compound_err = make_compound_exception(errors)
+                raise compound_err from errors[-1]
             
         if execute:
             return wrapper(*args, **kwargs)
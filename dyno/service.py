@@ -1,17 +1,170 @@
 #!/usr/bin/env python3
 """Service: Remote services framework
+
+>>> calls = service(lambda: 'pong', retry=3)
+>>> calls()
+'pong'
+>>> calls.metrics.successes
+1
+
+With a :py:class:`LastKnownGood` store the last successful result for the same
+arguments is served, wrapped in :py:class:`Stale`, when the service fails
+
+>>> up = [True]
+>>> def price(item):
+...     if not up[0]:
+...         raise IOError('connection refused')
+...     return 10
+>>> get_price = service(price, fallback=LastKnownGood(max_age=60))
+>>> get_price('apple')
+10
+>>> up[0] = False
+>>> stale = get_price('apple')
+>>> stale
+Stale(10)
+>>> stale.value, type(stale.error).__name__
+(10, 'OSError')
+>>> get_price.metrics.counters
+{'fallback.hit': 1}
+
+Results are only served for the same arguments, keyword only ones included
+
+>>> def stock(*, item):
+...     if not up[0]:
+...         raise IOError('connection refused')
+...     return item + ' in stock'
+>>> up[0] = True
+>>> get_stock = service(stock, fallback=LastKnownGood(max_age=60))
+>>> get_stock(item='apple')
+'apple in stock'
+>>> up[0] = False
+>>> get_stock(item='pear')
+Traceback (most recent call last):
+  ...
+OSError: connection refused
+
+The same goes for the extra arguments of a builder taking *args or **kwargs
+
+>>> def prices(*items, **options):
+...     if not up[0]:
+...         raise IOError('connection refused')
+...     return [10] * len(items)
+>>> up[0] = True
+>>> get_prices = service(prices, fallback=LastKnownGood(max_age=60))
+>>> get_prices('apple')
+[10]
+>>> up[0] = False
+>>> get_prices('apple')
+Stale([10])
+>>> get_prices('apple', currency='EUR')
+Traceback (most recent call last):
+  ...
+OSError: connection refused
 """
+from collections import OrderedDict as _OrderedDict
+from functools import wraps as _wraps
+from threading import Lock as _Lock
+from time import monotonic as _monotonic
+import logging as _logging
+
+from dyno.breaker import Limiter, RateLimited
+from dyno.cache import key_builder as _key_builder
+from dyno.command import command
+from dyno.metrics import Metrics
+
+log = _logging.getLogger('dyno.service')
 
-class PoolFull(Exception):
+class PoolFull(RateLimited):
     pass
 
-class Pool:
-    def __enter__(self):
-        raise PoolFull()
+class Pool(Limiter):
+    """Limit the amount of calls to a service in flight at once, extra calls are
+    rejected with :py:exc:`PoolFull`
+
+    :param int value: The maximum amount of concurrent calls
+    """
+    def __init__(self, value=10):
+        super().__init__(value)
+
+    def acquire(self):
+        try:
+            super().acquire()
+        except RateLimited:
+            raise PoolFull() from None
+
+class Stale:
+    """A result served by :py:class:`LastKnownGood` because the service failed
+
+    :py:attr:`value`: the last successful result
+    :py:attr:`age`: seconds since the result was stored
+    :py:attr:`error`: the exception the service failed with
+    """
+    __slots__ = ('value', 'age', 'error')
+
+    def __init__(self, value, age, error=None):
+        self.value = value
+        self.age = age
+        self.error = error
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.value)
+
+class LastKnownGood:
+    """Remember the last successful result of a service per argument key, to serve
+    when the service fails, times out or its breaker is open
+
+    :param int maxsize: maximum amount of keys to remember, the least recently
+                        stored are forgotten first
+    :param float max_age: seconds a result may be served for after it was stored,
+                          None to serve it no matter how old it is
+    :param keys: The names of the arguments that make up the key, all of them if
+                 empty, see :py:func:`dyno.cache.cache`
+    :param clock: function returning the current time in seconds
+    """
+    def __init__(self, maxsize=1024, max_age=300, keys=(), clock=_monotonic):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.keys = keys
+        self.clock = clock
+        self._lock = _Lock()
+        # key -> (stored at, value), least recently stored first
+        self._entries = _OrderedDict()
+
+    def store(self, key, value, now=None):
+        """Remember <value> as the last good result for <key>"""
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key, error=None, now=None):
+        """:returns: the last good result for <key> as a :py:class:`Stale` or None if 
+                     there isn't one or it is older than <max_age>
+        """
+        if now is None:
+            now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored, value = entry
+            age = now - stored
+            if self.max_age is not None and age > self.max_age:
+                del self._entries[key]
+                return None
+        return Stale(value, age, error)
+
+    def clear(self):
+        """Forget all stored results"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
 
-    def __exit__(self):
-        pass
-        
 # execution of command sync or async
 # is the circuit open?
 # is the thread pool/queue/semaphore full
@@ -22,21 +175,67 @@ class Pool:
 # failed response? => log, partially trip breaker => fallback
 # calculate circuit health
 
-def service(builder, metrics=None, breaker=None, pool=None):
-    if not metrics:
+def service(builder, metrics=None, breaker=None, pool=None, retry=None, fallback=None,
+            watchdog=None, clock=_monotonic):
+    """Wrap <builder>, a function that makes a single attempt to reach a service,
+    with metrics, a circuit breaker, a pool limiting concurrent calls and retries
+
+    :param builder: function to call
+    :param Metrics metrics: (optional) metrics to record outcomes in
+    :param breaker: (optional) an :py:class:`dyno.breaker.AutoBreaker` or a dict of
+                    arguments to build one (Default: an AutoBreaker sharing the
+                    window of <metrics>)
+    :param pool: (optional) a :py:class:`Pool`, :py:class:`dyno.breaker.Limiter` or
+                 the maximum amount of concurrent calls (Default: :py:class:`Pool`)
+    :param retry: (optional) a :py:class:`dyno.retry.Policy` or the amount of attempts
+    :param LastKnownGood fallback: (optional) store of the last successful results,
+                                   served as :py:class:`Stale` when a call fails. 
+                                   hits and misses are counted in <metrics> as
+                                   'fallback.hit' and 'fallback.miss'
+    :param Watchdog watchdog: (optional) sample the stacks of slow calls, see
+                              :py:func:`dyno.command.command`
+    :param clock: function returning the current time in seconds
+    :returns: the wrapped function, see :py:func:`dyno.command.command`
+    """
+    if metrics is None:
         metrics = Metrics()
-    if not circuit:
-        breaker = Breaker()
-    if not pool:
+    if breaker is None:
+        breaker = {}
+    if pool is None:
         pool = Pool()
+    elif isinstance(pool, int):
+        pool = Pool(pool)
+
+    # with a fallback a failure is only logged as an error if there is nothing to serve
+    call = command(breaker=breaker, limiter=pool, retry=retry, metrics=metrics,
+                   logger=log if fallback is None else None, watchdog=watchdog,
+                   clock=clock)(builder)
+    if fallback is None:
+        call.fallback = None
+        return call
+
+    make_key = _key_builder(builder, fallback.keys)
 
-    def check_metrics()
-        if metrics.failed_too_offten:
-            breaker.trigger()
+    @_wraps(builder)
+    def wrapped(*args, **kwargs):
+        key = make_key(args, kwargs)
+        try:
+            value = call(*args, **kwargs)
+        except Exception as err:
+            stale = fallback.get(key, err)
+            if stale is None:
+                metrics.incr('fallback.miss')
+                log.error('Exception in %s', builder, exc_info=err)
+                raise
+            log.warning('%s failed (%s), serving a result %.1fs old', builder, err, stale.age)
+            metrics.incr('fallback.hit')
+            return stale
+        fallback.store(key, value)
+        return value
 
-    def wrapped():
-        with metrics:
-            with breaker, pool:
-                val = builder()
-                log.info('all OK')
-                return val
+    wrapped.breaker = call.breaker
+    wrapped.limiter = call.limiter
+    wrapped.policy = call.policy
+    wrapped.metrics = metrics
+    wrapped.fallback = fallback
+    return wrapped
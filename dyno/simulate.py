@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""Simulate: drive stand-in downstream services through different policies and
+compare how they cope with faults
+
+Tuning breaker thresholds, pool sizes and retry counts against a real service is
+slow and risky. this module provides :py:class:`Downstream`, an in-process stand-in
+with a configurable latency distribution, error rate and brownout :py:class:`Phase`s,
+and :py:class:`Loopback` to serve one over a loopback socket so connection handling
+is part of the test. :py:func:`run` calls a policy at a fixed request rate and
+returns a :py:class:`Report` of throughput, latency percentiles, shed load and how
+long it took to recover after the last brownout
+
+>>> downstream = Downstream(latency=fixed(0.001), phases=[Phase(0.1, 0.1, error_rate=1.0)])
+>>> policies = {
+...     'bare': lambda downstream: downstream,
+...     'service': lambda downstream: service(downstream, retry=2),
+... }
+>>> reports = compare(policies, downstream, rate=200, duration=0.4)
+>>> reports['bare'].requests
+80
+>>> reports['bare'].outcomes['failure'] > 0
+True
+
+Run the bundled scenario with: python -m dyno.simulate
+"""
+from concurrent import futures as _futures
+from random import random as _random, uniform as _uniform, lognormvariate as _lognormvariate, \
+                   expovariate as _expovariate
+from socketserver import ThreadingTCPServer as _ThreadingTCPServer, \
+                         StreamRequestHandler as _StreamRequestHandler
+from threading import Thread as _Thread
+from time import monotonic as _monotonic, sleep as _sleep
+import argparse as _argparse
+import logging as _logging
+import math as _math
+import socket as _socket
+
+from dyno.breaker import Broken, RateLimited, AutoBreaker, Limiter
+from dyno.retry import retry, Policy, exponential
+from dyno.service import service
+from dyno.utils import percentile
+
+log = _logging.getLogger('dyno.simulate')
+
+PERCENTILES = (50, 90, 99)
+
+class SimulatedError(IOError):
+    """Raised by a :py:class:`Downstream` when it decides a request fails"""
+
+## latency distributions ##
+def fixed(seconds):
+    """Every request takes <seconds>"""
+    def latency():
+        return seconds
+    return latency
+
+def uniform(low, high):
+    """Requests take between <low> and <high> seconds"""
+    def latency():
+        return _uniform(low, high)
+    return latency
+
+def exponential_latency(mean):
+    """Request latencies are exponentially distributed around <mean> seconds"""
+    def latency():
+        return _expovariate(1 / mean)
+    return latency
+
+def lognormal(median, sigma=0.5):
+    """Request latencies have a long tail, half the requests take less than <median>
+    seconds, a larger <sigma> makes the tail longer
+    """
+    mu = _math.log(median)
+    def latency():
+        return _lognormvariate(mu, sigma)
+    return latency
+
+class Phase:
+    """A period where a :py:class:`Downstream` behaves differently, eg a brownout
+
+    :param float start: seconds after the simulation starts that the phase begins
+    :param float duration: seconds the phase lasts
+    :param latency: (optional) latency distribution to use during the phase
+    :param float error_rate: (optional) fraction of requests that fail during the phase
+    """
+    def __init__(self, start, duration, latency=None, error_rate=None):
+        self.start = start
+        self.duration = duration
+        self.latency = latency
+        self.error_rate = error_rate
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def __repr__(self):
+        return '<{}: {}s-{}s error_rate={}>'.format(
+               self.__class__.__name__, self.start, self.end, self.error_rate)
+
+class Downstream:
+    """An in-process stand-in for a downstream service, calling it sleeps for the
+    request latency then returns or raises :py:exc:`SimulatedError`
+
+    :param latency: latency distribution, a function returning seconds
+    :param float error_rate: fraction of requests that fail
+    :param phases: :py:class:`Phase`s that override the latency or error rate
+    :param clock: function returning the current time in seconds
+    :param sleep: function used to wait out the latency
+    """
+    def __init__(self, latency=lognormal(0.01), error_rate=0.0, phases=(),
+                 clock=_monotonic, sleep=_sleep):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.phases = list(phases)
+        self.clock = clock
+        self.sleep = sleep
+        self.start()
+
+    def start(self):
+        """Restart the phase schedule from now"""
+        self.epoch = self.clock()
+
+    @property
+    def brownout_end(self):
+        """seconds after the start that the last phase ends, None if there are none"""
+        if not self.phases:
+            return None
+        return max(phase.end for phase in self.phases)
+
+    def behaviour(self, now=None):
+        """:returns: (latency distribution, error rate) in effect at <now>"""
+        if now is None:
+            now = self.clock()
+        elapsed = now - self.epoch
+        latency, error_rate = self.latency, self.error_rate
+        for phase in self.phases:
+            if phase.start <= elapsed < phase.end:
+                if phase.latency is not None:
+                    latency = phase.latency
+                if phase.error_rate is not None:
+                    error_rate = phase.error_rate
+        return latency, error_rate
+
+    def __call__(self, *args, **kwargs):
+        latency, error_rate = self.behaviour()
+        self.sleep(latency())
+        if error_rate and _random() < error_rate:
+            raise SimulatedError('simulated failure')
+        return 'ok'
+
+class _Handler(_StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                self.server.downstream()
+            except SimulatedError:
+                self.wfile.write(b'error\n')
+            else:
+                self.wfile.write(b'ok\n')
+
+class Loopback:
+    """Serve a :py:class:`Downstream` on a loopback socket, calling this object
+    opens a connection, makes one request and closes it
+
+    :param Downstream downstream: The service to serve
+    :param float timeout: seconds to wait for the connection and the reply
+
+    >>> with Loopback(Downstream(latency=fixed(0))) as remote:
+    ...     remote()
+    'ok'
+    """
+    def __init__(self, downstream, timeout=1.0):
+        self.downstream = downstream
+        self.timeout = timeout
+        self._server = _ThreadingTCPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.downstream = downstream
+        self.address = self._server.server_address
+        self._thread = _Thread(target=self._server.serve_forever, name='dyno.simulate.Loopback',
+                               daemon=True)
+        self._thread.start()
+
+    def start(self):
+        self.downstream.start()
+
+    @property
+    def brownout_end(self):
+        return self.downstream.brownout_end
+
+    def __call__(self, *args, **kwargs):
+        with _socket.create_connection(self.address, self.timeout) as sock:
+            sock.sendall(b'call\n')
+            reply = sock.makefile('rb').readline()
+        if reply != b'ok\n':
+            raise SimulatedError('simulated failure over {}:{}'.format(*self.address))
+        return 'ok'
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *tb):
+        self.close()
+
+class Report:
+    """The outcome of :py:func:`run`
+
+    :py:attr:`requests`: amount of requests made
+    :py:attr:`outcomes`: mapping of 'success', 'failure', 'short_circuit' and 'rejected'
+                         to the amount of requests that ended that way
+    :py:attr:`throughput`: successful requests per second
+    :py:attr:`percentiles`: mapping of percentile to the latency of successful requests,
+                            measured from when the request was due to be sent
+    :py:attr:`shed`: fraction of requests refused by a breaker or limiter without
+                     reaching the downstream
+    :py:attr:`recovery`: seconds after the last brownout ended until the success rate
+                         was back to <recovered>, None if it never was or there was
+                         no brownout
+    """
+    def __init__(self, records, duration, brownout_end=None, resolution=0.25, recovered=0.95):
+        self.records = records
+        self.duration = duration
+        self.requests = len(records)
+
+        self.outcomes = dict.fromkeys(('success', 'failure', 'short_circuit', 'rejected'), 0)
+        latencies = []
+        for due, end, outcome in records:
+            self.outcomes[outcome] += 1
+            if outcome == 'success':
+                latencies.append(end - due)
+
+        self.throughput = self.outcomes['success'] / duration
+        self.percentiles = {}
+        if latencies:
+            for percent in PERCENTILES:
+                self.percentiles[percent] = percentile(min(percent, 99.9), latencies)
+        shed = self.outcomes['short_circuit'] + self.outcomes['rejected']
+        self.shed = shed / self.requests if self.requests else 0.0
+        self.recovery = None
+        if brownout_end is not None:
+            self.recovery = self._recovery(brownout_end, resolution, recovered)
+
+    def _recovery(self, brownout_end, resolution, recovered):
+        buckets = {}
+        for due, end, outcome in records_after(self.records, brownout_end):
+            counts = buckets.setdefault(int((due - brownout_end) / resolution), [0, 0])
+            counts[0] += 1
+            counts[1] += outcome == 'success'
+        for i in sorted(buckets):
+            total, succeeded = buckets[i]
+            if succeeded / total >= recovered:
+                return i * resolution
+        return None
+
+    def __str__(self):
+        percentiles = ' '.join('p{}={:.1f}mS'.format(percent, latency * 1000)
+                               for percent, latency in sorted(self.percentiles.items()))
+        recovery = 'n/a' if self.recovery is None else '{:.2f}S'.format(self.recovery)
+        return '{:.1f} req/S ok, {} failed, {:.1%} shed, recovery {}, {}'.format(
+               self.throughput, self.outcomes['failure'], self.shed, recovery,
+               percentiles or 'no successful requests')
+
+def records_after(records, start):
+    for record in records:
+        if record[0] >= start:
+            yield record
+
+def run(call, rate, duration, downstream=None, workers=64, clock=_monotonic, sleep=_sleep,
+        **report_kwargs):
+    """Call <call> <rate> times a second for <duration> seconds
+
+    Requests are sent on a fixed schedule whether or not earlier ones have finished
+    (an open loop) so a slow downstream shows up as higher latency instead of fewer
+    requests being made
+
+    :param call: the policy under test, called with no arguments
+    :param float rate: requests per second
+    :param float duration: seconds to run for
+    :param downstream: (optional) the :py:class:`Downstream` or :py:class:`Loopback`
+                       behind <call>, its phase schedule is restarted and its last
+                       brownout used to measure recovery
+    :param int workers: amount of threads making requests
+    :param clock: function returning the current time in seconds
+    :param sleep: function used to wait for the next request to be due
+    :param report_kwargs: passed on to :py:class:`Report`
+    :rtype: Report
+    """
+    records = []
+
+    def request(due):
+        try:
+            call()
+        except Broken:
+            outcome = 'short_circuit'
+        except RateLimited:
+            outcome = 'rejected'
+        except Exception:
+            outcome = 'failure'
+        else:
+            outcome = 'success'
+        # list.append is atomic so the workers don't need a lock
+        records.append((due - start, clock() - start, outcome))
+
+    start = clock()
+    if downstream is not None:
+        downstream.start()
+    with _futures.ThreadPoolExecutor(workers) as executor:
+        for i in range(int(rate * duration)):
+            due = start + i / rate
+            delay = due - clock()
+            if delay > 0:
+                sleep(delay)
+            executor.submit(request, due)
+
+    brownout_end = None if downstream is None else downstream.brownout_end
+    return Report(records, duration, brownout_end, **report_kwargs)
+
+def compare(policies, downstream, rate, duration, **kwargs):
+    """Run each of <policies> against <downstream> in turn
+
+    :param dict policies: mapping of name to a function that wraps <downstream> and
+                          returns the callable to test, called again for each run so
+                          every policy starts with a fresh breaker
+    :param downstream: the :py:class:`Downstream` or :py:class:`Loopback` to call
+    :param kwargs: passed on to :py:func:`run`
+    :returns: mapping of name to :py:class:`Report`
+    :rtype: dict
+    """
+    reports = {}
+    for name, policy in policies.items():
+        log.info('Simulating %s', name)
+        reports[name] = run(policy(downstream), rate, duration, downstream, **kwargs)
+    return reports
+
+def default_policies(pool=32, retries=3):
+    """The policies compared by the bundled scenario
+
+    :param int pool: maximum concurrent calls for the policies with a pool
+    :param int retries: attempts for the policies that retry
+    """
+    breaker = {'volume_threshold': 10, 'sleep_window': 0.5, 'health_interval': 0.05}
+    return {
+        'bare': lambda downstream: downstream,
+        'retry {}'.format(retries): lambda downstream: retry(retries)(downstream, execute=False),
+        'breaker + limiter': lambda downstream: _guarded(downstream, AutoBreaker(**breaker),
+                                                         Limiter(pool)),
+        'service': lambda downstream: service(downstream, breaker=breaker, pool=pool),
+        'service + retry {}'.format(retries): lambda downstream: service(
+            downstream, breaker=breaker, pool=pool,
+            retry=Policy(retries, backoff=exponential(0.01))),
+    }
+
+def _guarded(call, breaker, limiter):
+    def guarded():
+        with breaker, limiter:
+            return call()
+    return guarded
+
+def main(argv=None):
+    parser = _argparse.ArgumentParser(prog='python -m dyno.simulate',
+                                      description='Compare dyno policies against a failing downstream')
+    parser.add_argument('--rate', type=float, default=200, help='requests per second')
+    parser.add_argument('--duration', type=float, default=6, help='seconds to run each policy for')
+    parser.add_argument('--latency', type=float, default=0.01, help='median latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='fraction of requests that fail')
+    parser.add_argument('--brownout', default='2,2,0.5,0.2', 
+                        help='start,duration,error rate,latency of a brownout, "" for none')
+    parser.add_argument('--pool', type=int, default=32, help='maximum concurrent calls')
+    parser.add_argument('--retries', type=int, default=3, help='attempts for the retrying policies')
+    parser.add_argument('--loopback', action='store_true',
+                        help='serve the downstream over a loopback socket')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every exception that reaches a service')
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        # simulated failures are expected, only the report is interesting
+        _logging.getLogger('dyno.service').setLevel(_logging.CRITICAL)
+
+    phases = []
+    if args.brownout:
+        start, duration, error_rate, latency = (float(val) for val in args.brownout.split(','))
+        phases.append(Phase(start, duration, lognormal(latency), error_rate))
+    downstream = Downstream(lognormal(args.latency), args.error_rate, phases)
+    if args.loopback:
+        downstream = Loopback(downstream)
+
+    try:
+        reports = compare(default_policies(args.pool, args.retries), downstream,
+                          args.rate, args.duration)
+    finally:
+        if args.loopback:
+            downstream.close()
+
+    for name, report in reports.items():
+        print('{:<20} {}'.format(name, report))
+
+if __name__ == '__main__':
+    main()
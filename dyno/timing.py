@@ -2,16 +2,30 @@
 """Timing: Benchmark and Execution time monitoring functions
 
 :py:class:`PrettyTime`: Format a time value (float) for printing as a string
+:py:class:`SpanRecorder`: Compact storage for a large amount of time intervals
 :py:class:`PerfTimer`: Record Time intervals
 :py:func:`is_mark`: Test a PerfTimer object to see if it is a mark
 :py:func:`is_interval`: Test a PerfTimer object to see if it is an interval
 
 """
-from inspect import isfunction as _isfunction
-from functools import wraps as _wraps
-from time import time as now
-from collections import namedtuple as _namedtuple
-import resource as _resource
+from array import array as _array
+from time import time_ns as _time_ns
+from threading import Lock as _Lock, get_ident as _get_ident
+import json as _json
+import os as _os
+
+try:
+    import resource as _resource
+except ImportError: # not available on windows
+    _resource = None
+else:
+    _RUSAGE = getattr(_resource, 'RUSAGE_THREAD', _resource.RUSAGE_SELF)
+
+def rusage():
+    """:returns: resource usage of the current thread, None if unsupported"""
+    if _resource is None:
+        return None
+    return _resource.getrusage(_RUSAGE)
 
 
 class PrettyTime(float):
@@ -42,9 +56,186 @@ class PrettyTime(float):
         return str(val) + unit
 
 
+class SpanRecorder:
+    """Store time intervals (spans) as rows in a set of parallel arrays
+
+    Each span is an index into arrays of name ids, parent index, thread id and
+    start and end times in nanoseconds so a span costs a few dozen bytes instead
+    of a python object. names are stored once, descriptions and resource usage
+    only for the spans that have them. a span that was started but never ended
+    is a mark
+
+    :param bool rusage: if True record resource usage at the start and end of
+                        every span, this costs two system calls per span
+    :param clock: function returning the current UNIX time in nanoseconds
+
+    >>> recorder = SpanRecorder()
+    >>> request = recorder.begin('request')
+    >>> query = recorder.begin('query', parent=request)
+    >>> recorder.end(query); recorder.end(request)
+    >>> len(recorder)
+    2
+    >>> recorder.name(query), recorder.parent(query) == request
+    ('query', True)
+    >>> import io, json
+    >>> out = io.StringIO()
+    >>> recorder.write_chrome_trace(out)
+    >>> [event['name'] for event in json.loads(out.getvalue())['traceEvents']]
+    ['request', 'query']
+    """
+    def __init__(self, rusage=False, clock=_time_ns):
+        self.rusage = rusage
+        self.clock = clock
+        self._lock = _Lock()
+        self.clear()
+
+    def clear(self):
+        """Forget all recorded spans"""
+        self._names = []
+        self._name_ids = {}
+        self.names = _array('l')
+        self.parents = _array('l')
+        self.threads = _array('Q')
+        self.starts = _array('q')
+        self.ends = _array('q')
+        # only a few spans have these so they are kept out of the arrays
+        self.descriptions = {}
+        self.resources = {}
+
+    def _name_id(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            with self._lock:
+                # another thread may have added it while we waited for the lock
+                name_id = self._name_ids.get(name)
+                if name_id is None:
+                    # the name goes in the list before its id is visible to
+                    # the lock free lookups
+                    name_id = len(self._names)
+                    self._names.append(name)
+                    self._name_ids[name] = name_id
+        return name_id
+
+    def add(self, name, parent=-1, description=None):
+        """Add a span that has not been started yet
+
+        :param str name: A name by which to identify the span
+        :param int parent: index of the enclosing span, -1 for a top level span
+        :param str description: A short description of what is being recorded
+        :returns: index of the new span
+        :rtype: int
+        """
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_id(name)
+        with self._lock:
+            index = len(self.starts)
+            self.names.append(name_id)
+            self.parents.append(parent)
+            self.threads.append(_get_ident())
+            self.starts.append(0)
+            self.ends.append(0)
+        if description:
+            self.descriptions[index] = description
+        return index
+
+    def start(self, index, now=None):
+        """Start a span created with :py:meth:`add`
+
+        :param float now: (optional) the current time in nanoseconds if already known
+        """
+        self.starts[index] = self.clock() if now is None else now
+        if self.rusage:
+            self.resources[index] = (rusage(), None)
+
+    def begin(self, name, parent=-1, description=None, now=None):
+        """Add a span and start it
+
+        :returns: index of the new span
+        :rtype: int
+        """
+        index = self.add(name, parent, description)
+        self.start(index, now)
+        return index
+
+    def end(self, index, now=None):
+        """End the span at <index>
+
+        :param float now: (optional) the current time in nanoseconds if already known
+        """
+        self.ends[index] = self.clock() if now is None else now
+        if self.rusage:
+            self.resources[index] = (self.resources.get(index, (None,))[0], rusage())
+
+    def name(self, index):
+        return self._names[self.names[index]]
+
+    def rename(self, index, name):
+        self.names[index] = self._name_id(name)
+
+    def parent(self, index):
+        return self.parents[index]
+
+    def children(self, index):
+        """:returns: indexes of the spans directly below <index>, in the order they were added"""
+        return [i for i in range(index + 1, len(self.parents)) if self.parents[i] == index]
+
+    def walk(self, index):
+        """:returns: <index> and the indexes of every span below it, parents before
+                     their children
+        """
+        below = {}
+        for i in range(index + 1, len(self.parents)):
+            below.setdefault(self.parents[i], []).append(i)
+        stack = [index]
+        while stack:
+            i = stack.pop()
+            yield i
+            stack.extend(reversed(below.get(i, ())))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def write_chrome_trace(self, fp, pid=None):
+        """Write the spans to the file like object <fp> as Chrome trace event JSON
+        for chrome://tracing or https://ui.perfetto.dev
+
+        Spans are written one at a time so a large trace is never built up in memory,
+        marks are written as instant events and spans that were never started are
+        skipped
+
+        :param int pid: process id to put in the trace (Default: the current process)
+        """
+        if pid is None:
+            pid = _os.getpid()
+        # names are json encoded once rather than once per span
+        names = [_json.dumps(name) for name in self._names]
+        fp.write('{"traceEvents":[')
+        separator = '\n'
+        for i in range(len(self.starts)):
+            start = self.starts[i]
+            if not start:
+                continue
+            end = self.ends[i]
+            if end:
+                event = '{{"name":{},"ph":"X","ts":{:.3f},"dur":{:.3f},"pid":{},"tid":{}'.format(
+                        names[self.names[i]], start / 1000, (end - start) / 1000, pid, self.threads[i])
+            else:
+                event = '{{"name":{},"ph":"i","s":"t","ts":{:.3f},"pid":{},"tid":{}'.format(
+                        names[self.names[i]], start / 1000, pid, self.threads[i])
+            description = self.descriptions.get(i)
+            if description:
+                event += ',"args":{{"description":{}}}'.format(_json.dumps(description))
+            fp.write(separator + event + '}')
+            separator = ',\n'
+        fp.write('\n]}\n')
+
 class PerfTimer:
     """Record Time intervals and resource usage
 
+    A PerfTimer is a view of one span in a :py:class:`SpanRecorder`, creating a
+    child timer adds a span to the same recorder
+
     :py:meth:`start`: Start recording a time interval
     :py:meth:`stop`: Stop recording a time interval
     :py:attr:`start_time`: UNIX time of interval start
@@ -64,20 +255,56 @@ class PerfTimer:
     >>> 2+3 #doctest:+SKIP
     >>> timer.stop()
     """
-    def __init__(self, name=None, description=None):
+    __slots__ = ('recorder', 'index')
+
+    def __init__(self, name=None, description=None, recorder=None, parent=-1):
         """ 
         :param str name: A name by which to identify the interval
         :param str description: A short description of what is being recorded
+        :param SpanRecorder recorder: (optional) recorder to store the interval in,
+                                      resource usage is only recorded if the recorder
+                                      was created with rusage=True (Default: a new
+                                      recorder)
+        :param int parent: index of the enclosing span in <recorder>
         """
-        self.name = name
-        self.description = description
+        if recorder is None:
+            recorder = SpanRecorder()
+        self.recorder = recorder
+        self.index = recorder.add(name, parent, description)
+
+    @property
+    def name(self):
+        return self.recorder.name(self.index)
 
-        self._children = []
+    @name.setter
+    def name(self, name):
+        self.recorder.rename(self.index, name)
 
-        self.start_time = None
-        self.start_resources = None
-        self.end_time = None
-        self.end_resources = None
+    @property
+    def description(self):
+        return self.recorder.descriptions.get(self.index)
+
+    @description.setter
+    def description(self, description):
+        self.recorder.descriptions[self.index] = description
+
+    @property
+    def start_time(self):
+        start = self.recorder.starts[self.index]
+        return start / 1e9 if start else None
+
+    @property
+    def end_time(self):
+        end = self.recorder.ends[self.index]
+        return end / 1e9 if end else None
+
+    @property
+    def start_resources(self):
+        return self.recorder.resources.get(self.index, (None, None))[0]
+
+    @property
+    def end_resources(self):
+        return self.recorder.resources.get(self.index, (None, None))[1]
 
     def __enter__(self):
         return self.start()
@@ -94,18 +321,16 @@ class PerfTimer:
         ~~~~~~~~~~
         :py:exc:`ValueError`: Raised if an interval has already been started
         """
-        if self.start_time:
+        recorder, index = self.recorder, self.index
+        if recorder.starts[index]:
             raise ValueError('PerfTimer already started')
             
-        if not name:
-            name = self.name
-        self.name = name
-        
+        if name:
+            recorder.rename(index, name)
         if description:
-            self.description = description
+            recorder.descriptions[index] = description
         
-        self.start_time = now()
-        self.start_resrouces = _resource.getrusage(_resource.RUSAGE_THREAD)
+        recorder.start(index)
 
         return self
         
@@ -119,11 +344,10 @@ class PerfTimer:
         ~~~~~~~~~~
         :py:exc:`ValueError`: Raised if an interval has already been recorded
         """
-        if self.end_time:
+        if self.recorder.ends[self.index]:
             raise ValueError('PerfTimer already terminated')
 
-        self.end_time = now()
-        self.end_resources = _resource.getrusage(_resource.RUSAGE_THREAD)
+        self.recorder.end(self.index)
     
     def mark(self, name, description=None):
         """Mark a stage or step in an interval without creating multiple PerfTimers
@@ -134,9 +358,16 @@ class PerfTimer:
 
         mark = self(name, description)
         mark.start()
+
+    def write_chrome_trace(self, fp, pid=None):
+        """Write every interval in this timer's recorder as Chrome trace event JSON,
+        see :py:meth:`SpanRecorder.write_chrome_trace`
+        """
+        self.recorder.write_chrome_trace(fp, pid)
     
     def __float__(self):
-        return self.end_time - self.start_time
+        recorder, index = self.recorder, self.index
+        return (recorder.ends[index] - recorder.starts[index]) / 1e9
         
     def __round__(self, n=0):
         f = self.__float__()
@@ -148,36 +379,29 @@ class PerfTimer:
 
     def __repr__(self):
         if self.end_time:
-            interval = PrettyTime(self.end_time - self.start_time)
+            interval = PrettyTime(float(self))
         else:
             interval = '"Still Running"'
 
         return '<{}: name: {}, start={:.3F}, interval={}>'.format(self.__class__.__name__, 
                                                                       repr(self.name),
-                                                                      self.start_time, 
+                                                                      self.start_time or 0, 
                                                                       interval,
                                                                      )
     
     def __iter__(self):
-        yield self
-        for children in self._children:
-            for child in children:
-                yield child
+        recorder = self.recorder
+        for index in recorder.walk(self.index):
+            child = object.__new__(self.__class__)
+            child.recorder = recorder
+            child.index = index
+            yield child
             
     def __call__(self, name=None, description=None):
-        child = self.__class__(name, description)
-        self._children.append(child)
-        
-        return child
+        return self.__class__(name, description, self.recorder, self.index)
 
     def __len__(self):
-        total = 0
-        for child in self._children:
-            total += len(child)
-        
-        total += 1
-        
-        return total
+        return sum(1 for index in self.recorder.walk(self.index))
 
     def __str__(self, event_times=True, interval_times=True):
         """ 
@@ -217,7 +441,7 @@ class PerfTimer:
                 events.append((event.end_time, event))
         
         times = marks + events
-        times.sort()
+        times.sort(key=lambda time: time[0])
     
         template = ""
         if event_times:
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Watchdog: find out where slow calls spend their time
+
+Calls are tracked while they are in flight, which costs a clock read and a dict
+insert and removal. a background thread wakes up every <interval> seconds and
+takes a stack sample of each call that has been running for longer than its
+threshold, so fast calls are never sampled. the samples are counted per service
+giving a report of the stacks slow calls were seen in most often
+
+>>> from time import sleep
+>>> watchdog = Watchdog(threshold=0.01, interval=0.005)
+>>> @watchdog('db')
+... def slow_query():
+...     sleep(0.1)
+>>> slow_query()
+>>> watchdog.stop()
+>>> count, stack = watchdog.report('db')[0]
+>>> count > 1
+True
+>>> stack[-1][2]
+'slow_query'
+"""
+from collections import Counter as _Counter
+from contextlib import contextmanager as _contextmanager
+from functools import wraps as _wraps
+from itertools import count as _count
+from threading import Lock as _Lock, Thread as _Thread, Event as _Event, get_ident as _get_ident
+from time import monotonic as _monotonic
+import logging as _logging
+import sys as _sys
+
+from dyno.timing import PrettyTime
+
+log = _logging.getLogger('dyno.watchdog')
+
+class Watchdog:
+    """Sample the stacks of calls that run for longer than a threshold
+
+    :param float threshold: seconds a call may run before it is sampled
+    :param float interval: seconds between checks of the calls in flight
+    :param int max_stacks: maximum amount of distinct stacks kept per service,
+                           the least seen stack is dropped to make room
+    :param int depth: maximum amount of frames kept per stack, the innermost are kept
+    :param Metrics metrics: (optional) count samples in 'watchdog.{service}.samples'
+                            and slow calls in 'watchdog.{service}.slow'
+    :param clock: function returning the current time in seconds
+    """
+    def __init__(self, threshold=1.0, interval=0.1, max_stacks=100, depth=32,
+                 metrics=None, clock=_monotonic):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.depth = depth
+        self.metrics = metrics
+        self.clock = clock
+
+        self._ids = _count()
+        # id -> (service, thread id, start time, threshold)
+        self._inflight = {}
+        # ids of calls that have been sampled at least once
+        self._slow = set()
+        # service -> Counter of stack -> samples
+        self._stacks = {}
+        self._lock = _Lock()
+        self._thread = None
+        self._stopping = _Event()
+
+    def enter(self, service, threshold=None):
+        """Start tracking a call made by the current thread
+
+        :param str service: the name to report samples under
+        :param float threshold: (optional) override the default threshold for this call
+        :returns: token to pass to :py:meth:`exit`
+        """
+        if self._thread is None:
+            self.start()
+        token = next(self._ids)
+        self._inflight[token] = (service, _get_ident(), self.clock(),
+                                 self.threshold if threshold is None else threshold)
+        return token
+
+    def exit(self, token):
+        """Stop tracking the call started by :py:meth:`enter`"""
+        del self._inflight[token]
+        if self._slow:
+            self._slow.discard(token)
+
+    @_contextmanager
+    def track(self, service, threshold=None):
+        """Context manager that tracks the calls made in its body"""
+        token = self.enter(service, threshold)
+        try:
+            yield
+        finally:
+            self.exit(token)
+
+    def __call__(self, service, threshold=None):
+        """Decorator that tracks every call to the decorated function"""
+        def outer(func):
+            @_wraps(func)
+            def inner(*args, **kwargs):
+                token = self.enter(service, threshold)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.exit(token)
+            return inner
+        return outer
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.depth:
+            code = frame.f_code
+            stack.append((code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def sample(self, now=None):
+        """Take a stack sample of every call in flight that is over its threshold
+
+        :param float now: (optional) the current time if already known
+        :returns: amount of samples taken
+        :rtype: int
+        """
+        if now is None:
+            now = self.clock()
+        # forget calls that finished while they were being sampled
+        self._slow.intersection_update(self._inflight)
+        slow = [(token, service, thread)
+                for token, (service, thread, start, threshold) in list(self._inflight.items())
+                if now - start >= threshold]
+        if not slow:
+            return 0
+
+        frames = _sys._current_frames()
+        taken = 0
+        for token, service, thread in slow:
+            frame = frames.get(thread)
+            if frame is None or token not in self._inflight:
+                continue
+            self._record(service, self._stack(frame))
+            taken += 1
+            if self.metrics is not None:
+                self.metrics.incr('watchdog.{}.samples'.format(service))
+                if token not in self._slow:
+                    self.metrics.incr('watchdog.{}.slow'.format(service))
+            self._slow.add(token)
+        return taken
+
+    def _record(self, service, stack):
+        with self._lock:
+            stacks = self._stacks.get(service)
+            if stacks is None:
+                stacks = self._stacks[service] = _Counter()
+            if stack not in stacks and len(stacks) >= self.max_stacks:
+                least, count = min(stacks.items(), key=lambda item: item[1])
+                del stacks[least]
+            stacks[stack] += 1
+
+    def report(self, service, n=None):
+        """:returns: the <n> (Default: all) stacks sampled most often for <service>
+                     as a list of (samples, stack), each stack is a tuple of
+                     (filename, line number, function name) outermost first
+        """
+        with self._lock:
+            stacks = self._stacks.get(service)
+            if not stacks:
+                return []
+            return [(count, stack) for stack, count in stacks.most_common(n)]
+
+    def services(self):
+        """:returns: the names of the services that have had samples taken"""
+        with self._lock:
+            return list(self._stacks)
+
+    def format(self, service, n=5):
+        """:returns: the <n> hottest stacks for <service> as text"""
+        output = []
+        for count, stack in self.report(service, n):
+            output.append('{} samples (~{} spent over threshold):'.format(
+                          count, PrettyTime(count * self.interval)))
+            for filename, lineno, name in stack:
+                output.append('  {}:{} in {}'.format(filename, lineno, name))
+        return '\n'.join(output)
+
+    def clear(self):
+        """Forget all samples"""
+        with self._lock:
+            self._stacks.clear()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                log.exception('Sampling in flight calls failed')
+
+    def start(self):
+        """Start the background thread, called automatically by :py:meth:`enter`"""
+        with self._lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = _Thread(target=self._run, name='dyno.watchdog.Watchdog', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, it is restarted by the next tracked call"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            thread.join()